@@ -0,0 +1,227 @@
+#======================================================================================
+#============================================================================ BENCHMARK
+#======================================================================================
+
+# Feeds recorded frames through the same functions used by the sensor loop, with local
+# stand-ins for InfluxDB and Adriabus, and reports per-stage latency as JSON.
+#
+# Usage: python benchmark.py [--config config.json] [--frames last-frame.jpg captures/ ...]
+#                            [--cycles 50] [--video recording.mp4] [--output report.json]
+
+#============================================================================== Imports
+import argparse
+import datetime
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+import utils
+
+#============================================================================== Local stand-ins
+
+# Accepts every request: 204 like InfluxDB's /api/v2/write, 200 for Adriabus
+class FakeEndpointHandler(http.server.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		self.server.requests += 1
+
+		status = 204 if self.path.startswith('/api/v2/write') else 200
+		self.send_response(status)
+		self.send_header('Content-Length', '0')
+		self.end_headers()
+
+	def log_message(self, format, *args):
+		pass
+
+def startFakeServer():
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeEndpointHandler)
+	server.requests = 0
+	threading.Thread(target = server.serve_forever, daemon = True).start()
+	return server
+
+#============================================================================== Utility functions
+
+# Latency percentiles (ms) and throughput (ops/s) of a list of durations in seconds
+def summarize(samples):
+	samples = np.array(samples) * 1000
+	return {
+		'count': len(samples),
+		'mean-ms': float(np.mean(samples)),
+		'p50-ms': float(np.percentile(samples, 50)),
+		'p95-ms': float(np.percentile(samples, 95)),
+		'p99-ms': float(np.percentile(samples, 99)),
+		'throughput': float(1000 / np.mean(samples))
+	}
+
+# CPU cost (process time, decoder threads included) of a recorded stream read with the OpenCV FFmpeg backend:
+# the always-open stream grabs, and so decodes, every frame 24/7, while opening the stream for each burst
+# only decodes the frames of the burst, every min-wait seconds at most
+def measureDecode(path, application, maxFrames = 3000):
+	video = cv2.VideoCapture(path)
+	fps = video.get(cv2.CAP_PROP_FPS) or 25
+	start = time.process_time()
+	frames = 0
+	while frames < maxFrames and video.grab():
+		if frames % application.frameToSkip == 0:
+			video.retrieve()
+		frames += 1
+	continuous = time.process_time() - start
+	video.release()
+	if frames == 0:
+		raise Exception(f"No frames decoded from {path}")
+
+	start = time.process_time()
+	video = cv2.VideoCapture(path)
+	for i in range(application.burstSize * application.frameToSkip):
+		if not video.grab():
+			break
+		if i % application.frameToSkip == 0:
+			video.retrieve()
+	video.release()
+	burst = time.process_time() - start
+
+	return {
+		'frames': frames,
+		'always-open-cpu-ms-per-frame': continuous / frames * 1000,
+		'always-open-cpu-s-per-hour': continuous / frames * fps * 3600,
+		'open-per-burst-cpu-ms': burst * 1000,
+		'open-per-burst-cpu-s-per-hour': burst * 3600 / application.minWait
+	}
+
+#============================================================================== Application
+
+parser = argparse.ArgumentParser(description = 'Bus sensor per-stage benchmark')
+parser.add_argument('--config', default = 'config.json')
+parser.add_argument('--frames', nargs = '+', default = ['last-frame.jpg'])
+parser.add_argument('--cycles', type = int, default = 50)
+parser.add_argument('--video', default = None, help = 'recorded stream: decode cost of the always-open stream against open per burst')
+parser.add_argument('--output', default = None)
+args = parser.parse_args()
+
+cfg = utils.loadSettings(args.config)
+burstSize = cfg.application.burstSize
+
+files = utils.listFrames(args.frames)
+if not files:
+	raise Exception("No frames to benchmark")
+
+# Inference model (worker processes are forked before the other threads start)
+detectorArgs = {
+	'modelPath': cfg.application.modelPath,
+	'conf': cfg.application.inferenceConf,
+	'backend': cfg.application.inferenceBackend,
+	'batchSize': cfg.application.inferenceBatchSize,
+	'imgsz': cfg.application.inferenceImgsz
+}
+if cfg.application.inferenceWorkers > 0:
+	model = utils.InferencePool(cfg.application.inferenceWorkers, detectorArgs)
+else:
+	model = utils.YoloDetector(**detectorArgs)
+
+# Same chain as the first camera of the sensor: region of interest and tracking as configured
+roi = utils.RegionOfInterest(cfg.cameras[0].roi) if cfg.cameras[0].roi else None
+detector = utils.cameraDetector(model, roi, cfg.application)
+
+# Local endpoints instead of the real ones
+influxServer = startFakeServer()
+adriabusServer = startFakeServer()
+cfg.influx.url = f'http://127.0.0.1:{influxServer.server_port}'
+cfg.influx.token = 'benchmark'
+cfg.influx.org = cfg.influx.org or 'benchmark'
+cfg.influx.bucket = cfg.influx.bucket or 'benchmark'
+cfg.influx.urlAdriabus = f'http://127.0.0.1:{adriabusServer.server_port}/'
+
+manager = utils.InfluxManager(cfg.influx)
+adriabus = utils.AdriabusPublisher(cfg.influx.urlAdriabus, cfg.influx.adriabusConnectTimeout, cfg.influx.adriabusReadTimeout)
+
+predictor = utils.CountPredictor(cfg.application.predictorPath, 1, cfg.application.predictionHorizon)
+
+jpegPath = os.path.join(tempfile.mkdtemp(), 'last-frame.jpg')
+
+# Warm-up: the first inference pays for lazy initialization
+detector.detect([cv2.imread(files[0])])
+
+stages = {name: [] for name in ['capture', 'inference', 'predict', 'draw', 'jpeg', 'publish', 'cycle']}
+countPrev = 0
+index = 0
+
+for cycle in range(args.cycles):
+	cycleStart = time.perf_counter()
+
+	# Capture: decode the recorded frames of one burst
+	start = time.perf_counter()
+	buffer = []
+	for _ in range(burstSize):
+		buffer.append(cv2.imread(files[index % len(files)]))
+		index += 1
+	stages['capture'].append(time.perf_counter() - start)
+
+	# Inference
+	start = time.perf_counter()
+	counts, boxes = detector.detect(buffer)
+	stages['inference'].append(time.perf_counter() - start)
+
+	count = max(counts)
+	delta = abs(count - countPrev)
+	countPrev = count
+
+	# Prediction
+	start = time.perf_counter()
+	prediction = predictor.update(0, count)
+	rounded_prediction = round(float(prediction[0]))
+	stages['predict'].append(time.perf_counter() - start)
+
+	# Drawing
+	start = time.perf_counter()
+	drawnFrame = utils.drawDetections(buffer[-1], boxes[-1])
+	stages['draw'].append(time.perf_counter() - start)
+
+	# JPEG writing
+	start = time.perf_counter()
+	cv2.imwrite(jpegPath, drawnFrame)
+	stages['jpeg'].append(time.perf_counter() - start)
+
+	# Publishing: full round trip to both stand-ins
+	start = time.perf_counter()
+	manager.writeLines([manager.buildPoint({'bus-stop-count': count, 'bus-stop-delta': delta, 'bus-stop-prediction': rounded_prediction}, time.time())])
+	adriabus.post({'CodiceLocalita':cfg.influx.location,'NumPersone':int(count),'NumPersonePrediction':int(rounded_prediction),'DataOraEvento':str(datetime.datetime.now()),'Note':'Benchmark'})
+	stages['publish'].append(time.perf_counter() - start)
+
+	stages['cycle'].append(time.perf_counter() - cycleStart)
+
+report = {
+	'frames': len(files),
+	'cycles': args.cycles,
+	'burst-size': burstSize,
+	'inference-backend': cfg.application.inferenceBackend,
+	'inference-batch-size': cfg.application.inferenceBatchSize,
+	'inference-workers': cfg.application.inferenceWorkers,
+	'inference-imgsz': cfg.application.inferenceImgsz,
+	'model-path': cfg.application.modelPath,
+	'roi': roi is not None,
+	'tracking-enabled': cfg.application.trackingEnabled,
+	'stages': {name: summarize(samples) for name, samples in stages.items()},
+	'requests': {'influx': influxServer.requests, 'adriabus': adriabusServer.requests}
+}
+report['stages']['cycle']['frames-per-second'] = report['stages']['cycle']['throughput'] * burstSize
+if args.video:
+	report['decode'] = measureDecode(args.video, cfg.application)
+
+manager.close()
+adriabus.close()
+if isinstance(model, utils.InferencePool):
+	model.close()
+influxServer.shutdown()
+adriabusServer.shutdown()
+
+output = json.dumps(report, indent = 4)
+if args.output:
+	with open(args.output, 'w') as file:
+		file.write(output)
+print(output)
@@ -0,0 +1,18 @@
+#======================================================================================
+#=============================================================================== EXPORT
+#======================================================================================
+
+#============================================================================== Imports
+import sys
+import utils
+
+#============================================================================== Application
+
+# Usage: python export.py [config.json] [backend]
+configPath = sys.argv[1] if len(sys.argv) > 1 else '/home/pi/Desktop/BusSensor/config.json'
+cfg = utils.loadSettings(configPath)
+
+backend = sys.argv[2] if len(sys.argv) > 2 else cfg.application.inferenceBackend
+
+artifact = utils.exportModel(cfg.application.modelPath, backend, cfg.application.inferenceImgsz)
+print(f'{backend}: {artifact}')
@@ -0,0 +1,181 @@
+#======================================================================================
+#============================================================================== OFFLINE
+#======================================================================================
+
+# Runs the counting and prediction pipeline over a recorded video or a directory of
+# images as fast as the hardware allows (no waits), and writes per-frame and per-burst
+# counts, deltas and predictions to CSV or Parquet.
+#
+# Usage: python offline.py INPUT [--config config.json] [--output counts.csv]
+#                          [--burst-size 4] [--frame-step 15] [--workers 1]
+
+#============================================================================== Imports
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import utils
+
+# Detector of the current process (one per worker)
+detector = None
+
+#============================================================================== Utility functions
+
+def createDetector(cfg, threads):
+	if threads > 0:
+		import torch
+		torch.set_num_threads(threads)
+
+	detector = utils.YoloDetector(
+		cfg.application.modelPath,
+		cfg.application.inferenceConf,
+		backend = cfg.application.inferenceBackend,
+		batchSize = cfg.application.inferenceBatchSize,
+		imgsz = cfg.application.inferenceImgsz
+	)
+
+	# Count only inside the region of interest, if any
+	if cfg.application.roi:
+		detector = utils.RegionDetector(detector, utils.RegionOfInterest(cfg.application.roi))
+
+	return detector
+
+# Sampled frames of a shard: (index, name, timestamp, frame)
+def readFrames(inputPath, start, stop, step):
+	if os.path.isdir(inputPath):
+		files = listImages(inputPath)
+		for i in range(start, stop, step):
+			yield i, files[i], os.path.getmtime(os.path.join(inputPath, files[i])), cv2.imread(os.path.join(inputPath, files[i]))
+		return
+
+	video = cv2.VideoCapture(inputPath)
+	fps = video.get(cv2.CAP_PROP_FPS) or 25
+	video.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+	for i in range(start, stop):
+		# grab() still decodes the skipped frames (FFmpeg backend), retrieve() only converts the colours
+		if not video.grab():
+			break
+		if (i - start) % step == 0:
+			result, frame = video.retrieve()
+			if not result:
+				break
+			yield i, f'frame-{i}', i / fps, frame
+
+	video.release()
+
+def listImages(path):
+	return sorted(f for f in os.listdir(path) if f.lower().endswith(utils.IMAGE_EXTENSIONS))
+
+def countFrames(inputPath):
+	if os.path.isdir(inputPath):
+		return len(listImages(inputPath))
+
+	video = cv2.VideoCapture(inputPath)
+	total = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+	video.release()
+	return total
+
+# Per-frame counts of one shard, in batches
+def processShard(cfg, threads, inputPath, start, stop, step):
+	global detector
+	if detector is None:
+		detector = createDetector(cfg, threads)
+
+	batchSize = cfg.application.inferenceBatchSize
+	rows = []
+	batch = []
+
+	def flush():
+		counts, _ = detector.detect([b[3] for b in batch])
+		for (index, name, timestamp, _), count in zip(batch, counts):
+			rows.append({'frame': index, 'name': name, 'timestamp': timestamp, 'count': count})
+		batch.clear()
+
+	for item in readFrames(inputPath, start, stop, step):
+		if item[3] is None:
+			continue
+		batch.append(item)
+		if len(batch) == batchSize:
+			flush()
+	if batch:
+		flush()
+
+	return rows
+
+# Bursts of consecutive sampled frames: max count, delta and forecast, as in the live loop
+def computeBursts(cfg, frameRows, burstSize):
+	predictor = utils.CountPredictor(cfg.application.predictorPath, 1, cfg.application.predictionHorizon)
+
+	rows = []
+	countPrev = 0
+	for i in range(0, len(frameRows), burstSize):
+		burst = frameRows[i:i + burstSize]
+
+		count = max(r['count'] for r in burst)
+		delta = abs(count - countPrev)
+		countPrev = count
+
+		prediction = predictor.update(0, count)
+
+		row = {'burst': len(rows), 'first-frame': burst[0]['frame'], 'timestamp': burst[-1]['timestamp'], 'count': count, 'delta': delta}
+		for step, value in enumerate(prediction, 1):
+			row['prediction' if step == 1 else f'prediction-{step}'] = round(float(value))
+		rows.append(row)
+
+	return rows
+
+# CSV, or Parquet when the output ends with .parquet (needs pandas)
+def writeRows(path, rows):
+	if path.endswith('.parquet'):
+		import pandas
+		pandas.DataFrame(rows).to_parquet(path)
+		return
+
+	with open(path, 'w', newline = '') as file:
+		writer = csv.DictWriter(file, fieldnames = list(rows[0].keys()) if rows else [])
+		writer.writeheader()
+		writer.writerows(rows)
+
+#============================================================================== Application
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Bus sensor offline batch mode')
+	parser.add_argument('input', help = 'video file or directory of images')
+	parser.add_argument('--config', default = 'config.json')
+	parser.add_argument('--output', default = 'counts.csv', help = 'writes <name>-frames and <name>-bursts (.csv or .parquet)')
+	parser.add_argument('--burst-size', type = int, default = None)
+	parser.add_argument('--frame-step', type = int, default = None)
+	parser.add_argument('--workers', type = int, default = 1)
+	args = parser.parse_args()
+
+	cfg = utils.loadSettings(args.config)
+	burstSize = args.burst_size or cfg.application.burstSize
+	step = max(1, args.frame_step or cfg.application.frameToSkip)
+
+	start = time.perf_counter()
+
+	# Contiguous shards (aligned on the sampling step), one per worker process
+	total = countFrames(args.input)
+	workers = max(1, args.workers)
+	shardSize = -(-total // workers // step) * step
+	shards = [(i, min(i + shardSize, total)) for i in range(0, total, shardSize)] if total else []
+
+	if workers == 1:
+		results = [processShard(cfg, 0, args.input, a, b, step) for a, b in shards]
+	else:
+		threads = max(1, os.cpu_count() // workers)
+		with ProcessPoolExecutor(max_workers = workers) as pool:
+			results = list(pool.map(processShard, *zip(*[(cfg, threads, args.input, a, b, step) for a, b in shards])))
+
+	frameRows = [row for rows in results for row in rows]
+	burstRows = computeBursts(cfg, frameRows, burstSize)
+
+	base, ext = os.path.splitext(args.output)
+	writeRows(f'{base}-frames{ext or ".csv"}', frameRows)
+	writeRows(f'{base}-bursts{ext or ".csv"}', burstRows)
+
+	elapsed = time.perf_counter() - start
+	print(f'{len(frameRows)} frames, {len(burstRows)} bursts in {elapsed:.1f} s ({len(frameRows) / elapsed:.1f} frames/s)')
@@ -0,0 +1,210 @@
+#======================================================================================
+#============================================================================= QUANTIZE
+#======================================================================================
+
+# Builds INT8 detector models calibrated on frames captured by the sensors (last-frame.jpg,
+# capture archives), then compares them with the FP32 model on held-out frames: count error,
+# latency, memory and size, as JSON. The models are saved next to the .pt, where the
+# onnx-int8 / openvino-int8 / tflite-int8 inference backends load them.
+#
+# Usage: python quantize.py --frames last-frame.jpg captures/ ... [--config config.json]
+#                           [--formats onnx openvino tflite] [--holdout 0.2]
+#                           [--calibration-size 300] [--output report.json]
+
+#============================================================================== Imports
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import utils
+
+#============================================================================== Utility functions
+
+# Shuffled once (fixed seed): calibration frames and held-out frames never overlap
+def splitFrames(files, holdout, calibrationSize, seed = 0):
+	files = list(files)
+	random.Random(seed).shuffle(files)
+	heldOut = max(1, int(len(files) * holdout))
+	return files[heldOut:][:calibrationSize], files[:heldOut]
+
+# Model input as the exported model sees it: letterboxed to imgsz, RGB, NCHW float in [0, 1]
+def letterbox(frame, imgsz):
+	height, width = frame.shape[:2]
+	scale = imgsz / max(height, width)
+	resized = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation = cv2.INTER_LINEAR)
+
+	image = np.full((imgsz, imgsz, 3), 114, dtype = np.uint8)
+	top = (imgsz - resized.shape[0]) // 2
+	left = (imgsz - resized.shape[1]) // 2
+	image[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+
+	return np.ascontiguousarray(image[:, :, ::-1].transpose(2, 0, 1)[None], dtype = np.float32) / 255
+
+def artifactSize(path):
+	if os.path.isdir(path):
+		return sum(os.path.getsize(os.path.join(root, f)) for root, _, names in os.walk(path) for f in names)
+	return os.path.getsize(path)
+
+#============================================================================== Quantization
+
+# ONNX Runtime static quantization of the FP32 export (QDQ, per-channel INT8 weights, UINT8 activations)
+def quantizeOnnx(modelPath, files, imgsz):
+	import onnxruntime
+	from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+	source = utils.exportModel(modelPath, 'onnx', imgsz)
+	target = utils.exportedModelPath(modelPath, 'onnx-int8')
+	inputName = onnxruntime.InferenceSession(source, providers = ['CPUExecutionProvider']).get_inputs()[0].name
+
+	class FrameReader(CalibrationDataReader):
+		def __init__(self):
+			self.files = iter(files)
+
+		def get_next(self):
+			path = next(self.files, None)
+			return None if path is None else {inputName: letterbox(cv2.imread(path), imgsz)}
+
+	quantize_static(
+		source,
+		target,
+		FrameReader(),
+		quant_format = QuantFormat.QDQ,
+		activation_type = QuantType.QUInt8,
+		weight_type = QuantType.QInt8,
+		per_channel = True
+	)
+	return target
+
+# OpenVINO (NNCF) and TFLite INT8 exports of ultralytics, calibrated on a throwaway dataset of our frames
+def quantizeUltralytics(modelPath, files, imgsz, backend):
+	from ultralytics import YOLO
+
+	model = YOLO(modelPath)
+	target = utils.exportedModelPath(modelPath, backend)
+
+	with tempfile.TemporaryDirectory() as dataset:
+		os.makedirs(os.path.join(dataset, 'images'))
+		for i, path in enumerate(files):
+			os.symlink(os.path.abspath(path), os.path.join(dataset, 'images', f'{i:05d}{os.path.splitext(path)[1]}'))
+
+		data = os.path.join(dataset, 'data.yaml')
+		with open(data, 'w') as file:
+			json.dump({'path': dataset, 'train': 'images', 'val': 'images', 'names': model.names}, file)
+
+		# Dynamic input (as the other exports) where the format supports it, for inference-imgsz-ladder
+		exported = model.export(format = utils.BACKENDS[backend], imgsz = imgsz, int8 = True, dynamic = backend not in utils.STATIC_BACKENDS, data = data, fraction = 1.0)
+
+	# Same place as the other artifacts
+	if os.path.abspath(exported) != os.path.abspath(target):
+		if os.path.isdir(target):
+			shutil.rmtree(target)
+		shutil.move(exported, target)
+	return target
+
+#============================================================================== Evaluation
+
+# Counts and latency of one model over the held-out frames. Runs in its own process, so the
+# peak memory is the one of this model alone.
+def evaluate(modelPath, backend, conf, imgsz, files):
+	detector = utils.YoloDetector(modelPath, conf, backend = backend, batchSize = 1, imgsz = imgsz)
+	detector.warmUp(files[0])
+
+	counts = []
+	latencies = []
+	for path in files:
+		frame = cv2.imread(path)
+		start = time.perf_counter()
+		frameCounts, _ = detector.detect([frame])
+		latencies.append(time.perf_counter() - start)
+		counts.append(frameCounts[0])
+
+	return {
+		'counts': counts,
+		'latencies': latencies,
+		'max-rss-mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+		'artifact-mb': artifactSize(utils.exportedModelPath(modelPath, backend)) / 1e6
+	}
+
+# spawn: a forked child would inherit the peak memory of this process (models already loaded)
+def runIsolated(*args):
+	with ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context('spawn')) as pool:
+		return pool.submit(evaluate, *args).result()
+
+# Count error against the FP32 model and cost of one model
+def summarize(result, reference):
+	counts = np.array(result['counts'])
+	expected = np.array(reference['counts'])
+	latencies = np.array(result['latencies']) * 1000
+
+	return {
+		'count-mae': float(np.mean(np.abs(counts - expected))),
+		'count-bias': float(np.mean(counts - expected)),
+		'count-exact': float(np.mean(counts == expected)),
+		'total-count': int(counts.sum()),
+		'p50-ms': float(np.percentile(latencies, 50)),
+		'mean-ms': float(np.mean(latencies)),
+		'speedup': float(np.mean(reference['latencies']) * 1000 / np.mean(latencies)),
+		'max-rss-mb': result['max-rss-mb'],
+		'artifact-mb': result['artifact-mb']
+	}
+
+#============================================================================== Application
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Bus sensor INT8 quantization')
+	parser.add_argument('--config', default = 'config.json')
+	parser.add_argument('--frames', nargs = '+', default = ['last-frame.jpg'])
+	parser.add_argument('--formats', nargs = '+', choices = ['onnx', 'openvino', 'tflite'], default = ['onnx'])
+	parser.add_argument('--holdout', type = float, default = 0.2, help = 'fraction of the frames kept for the evaluation')
+	parser.add_argument('--calibration-size', type = int, default = 300)
+	parser.add_argument('--output', default = None)
+	args = parser.parse_args()
+
+	cfg = utils.loadSettings(args.config)
+	modelPath = cfg.application.modelPath
+	imgsz = cfg.application.inferenceImgsz
+
+	files = utils.listFrames(args.frames)
+	if len(files) < 2:
+		raise Exception("At least two frames are needed (calibration and evaluation)")
+	calibration, heldOut = splitFrames(files, args.holdout, args.calibration_size)
+
+	# INT8 models
+	artifacts = {}
+	for fmt in args.formats:
+		backend = f'{fmt}-int8'
+		start = time.perf_counter()
+		if fmt == 'onnx':
+			artifacts[backend] = quantizeOnnx(modelPath, calibration, imgsz)
+		else:
+			artifacts[backend] = quantizeUltralytics(modelPath, calibration, imgsz, backend)
+		print(f'{backend}: {artifacts[backend]} ({time.perf_counter() - start:.0f} s)')
+
+	# FP32 reference, then each FP32 export next to its INT8 model
+	conf = cfg.application.inferenceConf
+	reference = runIsolated(modelPath, 'pytorch', conf, imgsz, heldOut)
+	backends = ['pytorch'] + [b for fmt in args.formats for b in ([fmt] if fmt != 'tflite' else []) + [f'{fmt}-int8']]
+	results = {b: reference if b == 'pytorch' else runIsolated(modelPath, b, conf, imgsz, heldOut) for b in backends}
+
+	report = {
+		'model-path': modelPath,
+		'imgsz': imgsz,
+		'calibration-frames': len(calibration),
+		'held-out-frames': len(heldOut),
+		'artifacts': artifacts,
+		'backends': {b: summarize(result, reference) for b, result in results.items()}
+	}
+
+	output = json.dumps(report, indent = 4)
+	if args.output:
+		with open(args.output, 'w') as file:
+			file.write(output)
+	print(output)
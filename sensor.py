@@ -3,18 +3,18 @@
 #======================================================================================
 
 #============================================================================== Imports
+import time
+# Startup clock, before the heavy imports
+startTime = time.monotonic()
 import cv2
 import threading
-import numpy as np
-import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from pywatchdog import Watchdog
-import os
-from ultralytics import YOLO
+import signal
 import utils
 import sys
-import tflite_runtime.interpreter as tflite
-import requests
 import datetime
+import json
 
 #============================================================================== Global variables
 # Watchdog
@@ -22,215 +22,698 @@ wtd = Watchdog()
 wtd.open()
 wtd.timeout = 300
 
-# Shared readonly
-try:
-	cfg = utils.loadConfig('/home/pi/Desktop/BusSensor/config.json')
-except:
-	print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} - Error while loading configuration\n")
-	#exit()
-	time.sleep(1800) # Will trigger the watchdog
+# Shared readonly (replaced as a whole on reload)
+CONFIG_PATH = '/home/pi/Desktop/BusSensor/config.json'
+
+# Retried with backoff (the file may be in the middle of an update), the watchdog reboots once the budget is exhausted
+configHealth = utils.Health('config', 2, 60, 1800)
+while True:
+	try:
+		cfg = utils.loadSettings(CONFIG_PATH)
+		break
+	except Exception as e:
+		print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} - Error while loading configuration: {e}\n")
+		delay = configHealth.failure(e)
+		if configHealth.failed:
+			time.sleep(1800) # Will trigger the watchdog
+		time.sleep(delay)
+		wtd.keep_alive()
 
 # Use display
 useDisplay = False
 if len(sys.argv) > 1 and sys.argv[1] == '--display':
 	useDisplay = True
 
-#============================================================================== Utility functions
+# Cleared when the display window asks to quit
+running = True
 
-def computeMQ():
-	global cfg
-	
-	x0 = 0
-	x1 = 10
-	
-	y0 = cfg['application']['max-wait']
-	y1 = cfg['application']['min-wait']
-	
-	m = (y0 - y1) / (x0 - x1)
-	q = cfg['application']['max-wait']
-	
-	return (m, q)
+# Set once the recovery budget is exhausted: the watchdog is no longer fed
+rebooting = False
 
-# Compute how many seconds to wait
-def computeWaitTime(delta: int):
-	m,q = computeMQ()
+# Set while a reload is waiting for the bursts in flight to complete
+pendingReload = False
 
-	waitTime = m * delta + q
-	
-	return waitTime
+# Stages of the pipeline run mode (None in serial mode)
+pipeline = None
 
-# Acquire frames
-def acquireFrame():
-	global cfg
+#============================================================================== Camera
+
+# Per-camera state: capture thread, region of interest, gate and counters.
+# The model, the predictor and the publisher are shared by all the cameras.
+class Camera:
+	def __init__(self, index, settings):
+		self.index = index
+		self.settings = settings
+		self.tags = manager.buildTags(settings.host, settings.location, settings.room)
+		
+		self.countPrev = 0
+		self.counts, self.boxes = [], []
+		self.cansendprediction = False
+		
+		# Next scheduled burst, and whether a burst is still being processed
+		self.nextDue = 0.0
+		self.inFlight = False
+		
+		# Capture health: retried with backoff, the capture thread is restarted if it keeps failing
+		self.health = createHealth(f'camera-{index}')
+		
+		self.buildDetector()
+		self.buildLadder()
+		self.buildSceneGate()
+		self.buildScheduler()
+		self.startGrabber()
 	
-	# Camera
-	camera = cv2.VideoCapture(cfg['application']['source'])
+	# Shared model behind the region of interest and the tracking stage of this camera
+	def buildDetector(self):
+		self.roi = utils.RegionOfInterest(self.settings.roi) if self.settings.roi else None
+		self.detector = utils.cameraDetector(detector, self.roi, cfg.application)
 	
-	# Read frame
-	result, frame = camera.read()
+	# Model input size picked each cycle from the ladder, if any
+	def buildLadder(self):
+		self.ladder = None
+		if cfg.application.inferenceImgszLadder:
+			self.ladder = utils.ResolutionLadder(
+				cfg.application.inferenceImgszLadder,
+				cfg.application.imgszMinBoxHeight,
+				cfg.application.imgszCrowdCount
+			)
 	
-	# Close camera
-	camera.release()
+	# Scene-change gate, on the same region of interest as the detector
+	def buildSceneGate(self):
+		self.sceneGate = utils.SceneGate(
+			cfg.application.sceneGateThreshold,
+			cfg.application.sceneGateMaxInterval,
+			cfg.application.sceneGatePixelThreshold,
+			self.roi
+		)
 	
-	if not result:
-		raise Exception("Unable to read frame")
-	else:
-		return frame
-
-# Do the prediction of the number of the people
-def predict(interpreter, input_details, output_details, input_data):
-	input_data = np.reshape(input_data,(1,4,1))
-	input_data = input_data.astype(np.float32)
-	interpreter.set_tensor(input_details[0]['index'],input_data)
-	interpreter.invoke()
-	prediction = interpreter.get_tensor(output_details[0]['index'])
-	input_data = np.reshape(input_data,(1,4))
-	return prediction, input_data
+	def buildScheduler(self):
+		self.scheduler = utils.createScheduler(
+			cfg.application.scheduler,
+			self.settings.minWait,
+			self.settings.maxWait,
+			window = cfg.application.schedulerWindow,
+			changeScale = cfg.application.schedulerChangeScale
+		)
 	
-#============================================================================== Application
+	def startGrabber(self):
+		application = cfg.application
+		self.grabber = utils.FrameGrabber(
+			self.settings.source,
+			bufferSize = application.burstSize,
+			frameToSkip = application.frameToSkip,
+			minBackoff = application.reconnectMinBackoff,
+			maxBackoff = application.reconnectMaxBackoff,
+			backend = application.captureBackend,
+			width = application.captureWidth,
+			height = application.captureHeight,
+			decoder = application.captureDecoder,
+			keyframesOnly = application.captureKeyframesOnly,
+			log = events,
+			ffmpegDecoder = application.captureFfmpegDecoder
+		)
+		self.grabber.start()
+	
+	# Hot reload: re-initialize only the parts whose settings changed
+	def update(self, settings, applicationChanged, detectorChanged):
+		changed = self.settings.changed(settings)
+		self.settings = settings
+		self.tags = manager.buildTags(settings.host, settings.location, settings.room)
+		
+		if detectorChanged or 'roi' in changed or applicationChanged & TRACKING_SETTINGS:
+			self.buildDetector()
+		
+		if applicationChanged & LADDER_SETTINGS:
+			self.buildLadder()
+		
+		if 'roi' in changed:
+			self.buildSceneGate()
+		elif applicationChanged & {'sceneGateThreshold', 'sceneGateMaxInterval', 'sceneGatePixelThreshold'}:
+			self.sceneGate.threshold = cfg.application.sceneGateThreshold
+			self.sceneGate.maxInterval = cfg.application.sceneGateMaxInterval
+			self.sceneGate.pixelThreshold = cfg.application.sceneGatePixelThreshold
+		
+		if changed & {'minWait', 'maxWait'} or applicationChanged & {'scheduler', 'schedulerWindow', 'schedulerChangeScale'}:
+			self.buildScheduler()
+		
+		if 'source' in changed or applicationChanged & GRABBER_SETTINGS:
+			self.grabber.stop()
+			self.startGrabber()
+		
+		if applicationChanged & RECOVERY_SETTINGS:
+			updateHealth(self.health)
 
-print('===== BUS SENSOR =====')
+#============================================================================== Recovery
 
+RECOVERY_SETTINGS = {'recoveryMinBackoff', 'recoveryMaxBackoff', 'recoveryRebootBudget'}
 
-m,q = computeMQ()
-print(f'M: {m}\t\tQ: {q}')
+# Consecutive capture failures before the capture thread of a camera is restarted
+GRABBER_RESTART_FAILURES = 2
 
-# InfluxDB manager
-manager = utils.InfluxManager(cfg)
+def createHealth(name):
+	return utils.Health(name, cfg.application.recoveryMinBackoff, cfg.application.recoveryMaxBackoff, cfg.application.recoveryRebootBudget, events)
 
-# Inference model
-model = YOLO(cfg['application']['model-path'])
-countPrev = 0
+def updateHealth(health):
+	health.minBackoff = cfg.application.recoveryMinBackoff
+	health.maxBackoff = cfg.application.recoveryMaxBackoff
+	health.budget = cfg.application.recoveryRebootBudget
 
-# Bus counter predictor model
-interpreter = tflite.Interpreter(model_path="/home/pi/Desktop/BusSensor/bus_count_predictor.tflite")
-interpreter.allocate_tensors()
-input_details = interpreter.get_input_details()
-output_details = interpreter.get_output_details()
+# Last resort, once a subsystem has been failing for longer than the budget: stop feeding the watchdog
+def reboot(health):
+	global rebooting
+	rebooting = True
+	events.error('recovery', f'{health.name} failing for more than {health.budget:.0f} s, rebooting', failures = health.failures)
+	events.close()
+	time.sleep(1800) # The watchdog, already open, is no longer fed and triggers
 
-buffer = []
-buffer_input_predict = None
-prediction = 0
-cansendprediction = False
+# Capture failure: only this camera backs off (the others keep sampling), its capture thread is restarted if it keeps failing
+def recoverCamera(camera, exception):
+	delay = camera.health.failure(exception)
+	events.error('acquisition', 'Error while reading frames', exception, camera = camera.index, failures = camera.health.failures)
+	if camera.health.failed:
+		reboot(camera.health)
+	
+	if camera.health.failures % GRABBER_RESTART_FAILURES == 0:
+		camera.grabber.stop()
+		camera.startGrabber()
+	return delay
 
-wtd.close()
+# Inference failure: back off, then retry on a freshly loaded model
+def recoverDetector(exception):
+	global detector
+	delay = detectorHealth.failure(exception)
+	events.error('inference', 'Error while running inference', exception, failures = detectorHealth.failures)
+	if detectorHealth.failed:
+		reboot(detectorHealth)
+	
+	# A worker pool cannot be forked again once the other threads are running
+	if not isinstance(detector, utils.InferencePool):
+		try:
+			detector = utils.YoloDetector(**detectorArgs(cfg.application))
+			for camera in cameras:
+				camera.buildDetector()
+		except Exception as e:
+			events.error('inference', 'Error while reloading the model', e)
+	return delay
 
-# Application loop
-while True:
-	# Watchdog open
-	wtd.open()
-	wtd.timeout = 300
+# One burst of a camera goes through three steps: acquisition, inference, prediction and send.
+# Each step returns the job for the next one, or None when the burst ends there (the camera is rescheduled).
+# They run one after the other (serial run mode) or each in its own pipeline stage (pipeline run mode).
+
+# Progress: the watchdog is fed unless a reboot has been requested
+def feedWatchdog():
+	if not rebooting:
+		wtd.keep_alive()
+
+# Next burst of the camera, which is no longer in flight
+def reschedule(camera, waitTime):
+	camera.nextDue = time.time() + waitTime
+	camera.inFlight = False
+
+#======================================= Camera
+def acquireBurst(camera):
+	application = cfg.application
+	timer = utils.StageTimer()
 	
-	#======================================= Camera
-	buffer.clear()
 	try:
-		##### Frame 1
-		frame = acquireFrame()
-		wtd.keep_alive()
-		buffer.append(frame)
-		time.sleep(0.5)
-		
-		##### Frame 2
-		frame = acquireFrame()
-		wtd.keep_alive()
-		buffer.append(frame)
-		time.sleep(0.5)
-		
-		##### Frame 3
-		frame = acquireFrame()
-		wtd.keep_alive()
-		buffer.append(frame)
-		time.sleep(0.5)
+		# Take the newest frames from the capture thread
+		with timer.stage('acquisition'):
+			buffer, timestamps = camera.grabber.getBurst(
+				application.burstSize,
+				application.burstTimeout,
+				application.maxFrameAge
+			)
+		feedWatchdog()
+		camera.health.success()
+	except Exception as e:
+		reschedule(camera, recoverCamera(camera, e))
+		return None
+	
+	return {'camera': camera, 'timer': timer, 'buffer': buffer, 'timestamps': timestamps}
+
+#======================================= Inference
+def inferBurst(job):
+	application = cfg.application
+	camera, timer, buffer, timestamps = job['camera'], job['timer'], job['buffer'], job['timestamps']
+	
+	# Reuse the previous detections while the scene has not changed
+	gateFired = False
+	if application.sceneGateEnabled:
+		with timer.stage('gate'):
+			gateFired = camera.sceneGate.isStatic(buffer, timestamps[-1])
+	
+	imgsz = camera.ladder.imgsz if camera.ladder is not None else application.inferenceImgsz
+	if not gateFired:
+		# Whole burst in a single batched call
+		try:
+			with timer.stage('inference'):
+				camera.counts, camera.boxes = camera.detector.detect(buffer, imgsz)
+			detectorHealth.success()
+		except Exception as e:
+			reschedule(camera, recoverDetector(e))
+			return None
+		camera.sceneGate.analyzed(timestamps[-1])
 		
-		##### Frame 4
-		frame = acquireFrame()
-		wtd.keep_alive()
-		buffer.append(frame)
-	except:
-		with open(cfg['application']['log-file-path'], 'a') as log:
-			log.write(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} - Error while reading frames\n")
-		time.sleep(1800) # Will trigger the watchdog
-	
-	#======================================= Inference
-	counts = []
-	for f in buffer:
-		results = model(f, classes = [0], conf = cfg['application']['inference-conf'])
-		wtd.keep_alive()
-		counts.append(len(results[0].boxes.cpu()))
+		# Input size of the next cycle
+		if camera.ladder is not None:
+			camera.ladder.update(camera.boxes, camera.detector.inputShape(buffer[-1].shape))
+	feedWatchdog()
+	
+	job['gateFired'] = gateFired
+	job['imgsz'] = imgsz
+	return job
 
+#======================================= Prediction and send
+def publishBurst(job):
+	application = cfg.application
+	camera, timer, buffer, timestamps = job['camera'], job['timer'], job['buffer'], job['timestamps']
+	gateFired, imgsz = job['gateFired'], job['imgsz']
+	
 	# Get max count
-	count = max(counts)
+	count = max(camera.counts)
 	# Compute delta
-	delta = abs(count - countPrev)
+	delta = abs(count - camera.countPrev)
 	# Update previous count
-	countPrev = count
-	# Check if the buffer input predict is less than buffer input len predict 
-	if buffer_input_predict is None:
-		# Build the buffer for the first buffer input predict len times
-		buffer_input_predict = np.full((4,1),count)
-	#do the prediction
-	prediction, buffer_input_predict = predict(interpreter,input_details,output_details,buffer_input_predict)
-	rounded_prediction = round(prediction[0][0])
-	#======================================= Send data
-	try:
-		manager.sendCount(count)
-		manager.sendDelta(delta)
-		if cansendprediction:
-			manager.sendPrediction(rounded_prediction)
-			url = cfg['influx']['urlAdriabus']
-			codLocalita = cfg['influx']['location']
-			datehourevent = str(datetime.datetime.now())
-			resp = requests.post(url,json={'CodiceLocalita':codLocalita,'NumPersone':int(count),'NumPersonePrediction':int(rounded_prediction),'DataOraEvento':datehourevent,'Note':'Prova'})
-			#print(resp.text)
-		cansendprediction = True
-	except:
-		with open(cfg['application']['log-file-path'], 'a') as log:
-			log.write(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())} - Error while sending data\n")
-		time.sleep(1800) # Will trigger the watchdog
-	
-	
-	# Update input of the new prediction
-	buffer_input_predict = buffer_input_predict[0].tolist()
-	buffer_input_predict.pop(0)
-	buffer_input_predict.append(count)
-	buffer_input_predict = np.array([buffer_input_predict])
-
-
+	camera.countPrev = count
+	# Forecast of the next counts (the first count fills the whole input window)
+	with timer.stage('predict'):
+		prediction = predictor.update(camera.index, count)
+	rounded_prediction = round(float(prediction[0]))
+	rounded_horizon = [round(float(p)) for p in prediction]
 	# Determine the seconds which the sensor should sleep
-	waitTime = computeWaitTime(delta)
-	if waitTime > cfg['application']['max-wait']:
-		waitTime = cfg['application']['max-wait']
-	if waitTime < cfg['application']['min-wait']:
-		waitTime = cfg['application']['min-wait']
+	waitTime = camera.scheduler.nextWait(count, delta, float(prediction[0]), timestamps[-1])
+	
+	# One point per cycle, timestamped at capture time, and the Adriabus push: handed off, never blocks
+	fields = {'bus-stop-count': count, 'bus-stop-delta': delta, 'scene-gate-fired': int(gateFired), 'wait-time': waitTime}
+	if not gateFired:
+		fields['inference-imgsz'] = imgsz
+	if isinstance(camera.detector, utils.TrackingDetector):
+		# People seen in the whole burst, each counted once
+		fields['bus-stop-unique'] = camera.detector.uniqueCount
+		fields['detector-frames'] = camera.detector.keyFrames
+	fields.update(camera.scheduler.metrics(waitTime))
+	payload = None
+	if camera.cansendprediction:
+		fields['bus-stop-prediction'] = rounded_prediction
+		payload = {'CodiceLocalita':camera.settings.location,'NumPersone':int(count),'NumPersonePrediction':int(rounded_prediction),'DataOraEvento':str(datetime.datetime.now()),'Note':'Prova'}
+		
+		# Multi-step forecast
+		if len(rounded_horizon) > 1:
+			for step, value in enumerate(rounded_horizon[1:], 2):
+				fields[f'bus-stop-prediction-{step}'] = value
+			payload['NumPersonePredictionHorizon'] = rounded_horizon
+	with timer.stage('send'):
+		publisher.publish(fields, timestamps[-1], payload, tags = camera.tags)
+	camera.cansendprediction = True
 	
 	# Debug prints
+	print(f'===== Camera {camera.index} ({camera.settings.location})')
 	print(f'Bus Stop Count: {count}')
 	print(f'Bus Stop Delta: {delta}')
 	print(f'Wait Time: {waitTime} seconds')
+	print(f'Scene gate: {"fired" if gateFired else "inference"} ({camera.sceneGate.fired}/{camera.sceneGate.checked} cycles skipped)')
 	print("prediction array: ", prediction)
 	print("prediction value: ", rounded_prediction)
-	print("buffer input: ", buffer_input_predict)
-	
-	# Last inference draw on frame
-	array = results[-1].boxes.xyxy.cpu()
-	drawnFrame = buffer[-1].copy()
-	for i in array:
-		drawnFrame = cv2.rectangle(drawnFrame, (int(i[0]), int(i[1])), (int(i[2]), int(i[3])), (0,255,) ,2)
-	
-	if cfg['application']['save-last-frame']:
-		cv2.imwrite(cfg['application']['last-frame-path'], drawnFrame)
-	
-	############################################################ START DISPLAY
-	if useDisplay:
-		# Display frame
-		cv2.imshow('frame', drawnFrame)
-		# Exit on 'q' pressed (inside streaming window)
-		if cv2.waitKey(1) & 0xFF == ord('q'):
-			break
-	############################################################ END DISPLAY
-		
-	# Watchdog closed
+	print("buffer input: ", predictor.ordered(camera.index))
+	print("publisher: ", publisher.stats())
+	
+	# Last frame and its boxes into the in-memory ring: drawn and encoded only on request
+	snapshots.add(camera.index, timestamps[-1], buffer[-1], camera.boxes[-1])
+	
+	if application.saveLastFrame:
+		with timer.stage('draw'):
+			drawnFrame = utils.drawDetections(buffer[-1], camera.boxes[-1])
+		with timer.stage('imwrite'):
+			cv2.imwrite(camera.settings.lastFramePath, drawnFrame)
+	
+	# Stage timings as a separate measurement, with the latest delivery latency of each endpoint
+	if application.sendTimings:
+		timings = timer.fields()
+		if 'inference-ms' in timings:
+			timings['inference-per-frame-ms'] = round(timings['inference-ms'] / len(buffer), 3)
+		stats = publisher.stats()
+		timings['influx-write-ms'] = round(stats['influx']['latency-last'] * 1000, 3)
+		timings['adriabus-post-ms'] = round(stats['adriabus']['latency-last'] * 1000, 3)
+		publisher.publish(timings, timestamps[-1], measurement = 'sensor_timing', tags = camera.tags)
+	
+	# Error and retry counters per stage, with the health of the subsystems
+	health = events.counters()
+	for subsystem in [camera.health, detectorHealth, manager.health, adriabus.health]:
+		health.update(subsystem.fields())
+	health.update(camera.grabber.fields(f'capture-{camera.index}'))
+	health.update(outbox.fields())
+	if pipeline is not None:
+		health.update(pipeline.fields(application.pipelineStallTimeout))
+	publisher.publish(health, timestamps[-1], measurement = 'sensor_errors', tags = camera.tags)
+	
+	reschedule(camera, waitTime)
+	reportStartup(camera)
+
+# Serial run mode: the whole burst on the main thread
+def runCycle(camera):
+	job = acquireBurst(camera)
+	if job is not None:
+		job = inferBurst(job)
+	if job is not None:
+		publishBurst(job)
+
+# Pipeline run mode: a burst dropped by a stage (full queue, stale or failed) is retried after a short backoff
+def dropBurst(job):
+	camera = job if isinstance(job, Camera) else job['camera']
+	reschedule(camera, cfg.application.recoveryMinBackoff)
+
+# Startup metric, once the first count has been published
+def reportStartup(camera):
+	global startTime
+	if startTime is None:
+		return
+	startup = {'time-to-first-count-s': time.monotonic() - startTime, 'load-s': loadTime, 'warmup-s': warmupTime}
+	startTime = None
+	publisher.publish(startup, time.time(), measurement = 'sensor_startup', tags = camera.tags)
+	print(f"Startup - time to first count: {startup['time-to-first-count-s']:.1f} s (load {loadTime:.1f} s, warm-up {warmupTime:.1f} s)")
+
+
+#============================================================================== Hot reload
+
+# Settings that need a new model (also inferenceImgsz with a fixed input size backend)
+DETECTOR_SETTINGS = {'modelPath', 'inferenceBackend'}
+
+# Settings of the loaded model, applied in place (imgsz is an argument of every inference)
+INFERENCE_SETTINGS = {'inferenceConf', 'inferenceImgsz', 'inferenceBatchSize'}
+
+# Settings of the input size ladder
+LADDER_SETTINGS = {'inferenceImgszLadder', 'imgszMinBoxHeight', 'imgszCrowdCount'}
+
+# Settings of the tracking stage
+TRACKING_SETTINGS = {'trackingEnabled', 'trackingKeyInterval', 'trackingIou', 'trackingMaxMisses'}
+
+# Settings of the capture threads
+GRABBER_SETTINGS = {'burstSize', 'frameToSkip', 'reconnectMinBackoff', 'reconnectMaxBackoff', 'captureBackend', 'captureWidth', 'captureHeight', 'captureDecoder', 'captureFfmpegDecoder', 'captureKeyframesOnly'}
+
+# Settings only applied at startup
+RESTART_SETTINGS = {'runMode', 'pipelineQueueSize', 'pipelineDropPolicy', 'pipelineMaxJobAge', 'pipelineStallTimeout', 'logFilePath', 'logMaxSize', 'logBackups', 'logRingSize', 'logFlushInterval', 'inferenceWorkers', 'outboxPath', 'outboxMaxSize', 'outboxMaxAge', 'outboxDrainInterval', 'publisherWorkers', 'snapshotRingSize', 'snapshotHost', 'snapshotPort', 'snapshotQuality', 'snapshotScale', 'previewFps'}
+
+def detectorArgs(application):
+	return {
+		'modelPath': application.modelPath,
+		'conf': application.inferenceConf,
+		'backend': application.inferenceBackend,
+		'batchSize': application.inferenceBatchSize,
+		'imgsz': application.inferenceImgsz
+	}
+
+# Export of the model when not cached yet (minutes for OpenVINO on the Pi): it runs on its own thread
+# and the watchdog, when open, keeps being fed meanwhile
+def exportModel(application, feed):
+	with ThreadPoolExecutor(1) as exporter:
+		export = exporter.submit(utils.exportModel, application.modelPath, application.inferenceBackend, application.inferenceImgsz)
+		while not wait([export], timeout = 10).done:
+			if feed:
+				feedWatchdog()
+	return export.result()
+
+# Apply a changed configuration file, re-initializing only the components whose settings changed.
+# An invalid file is reported and the running configuration is kept.
+def reloadSettings():
+	global cfg, detector, predictor, manager, pendingReload
+	
+	deferred = pendingReload
+	pendingReload = False
+	try:
+		new = utils.loadSettings(CONFIG_PATH)
+	except Exception as e:
+		events.error('config', 'Error while reloading configuration', e)
+		return
+	
+	old = cfg
+	applicationChanged = old.application.changed(new.application)
+	influxChanged = old.influx.changed(new.influx)
+	
+	if not applicationChanged and not influxChanged and new.cameras == old.cameras:
+		cfg = new
+		return
+	
+	# A different number of cameras rebuilds the predictor and removes cameras: applied once no burst
+	# is in flight (a removed camera could still be in the publish stage)
+	if len(new.cameras) != len(old.cameras) and any(c.inFlight for c in cameras):
+		if not deferred:
+			print('===== Number of cameras changed: reload deferred until the bursts in flight are completed')
+		pendingReload = True
+		return
+	print(f'===== Reloading configuration: {sorted(applicationChanged | influxChanged)}')
+	
+	# New components are built first: if any of them fails the running configuration is kept
+	newDetector, newPredictor, newManager = detector, predictor, manager
+	try:
+		# Model: reloaded only when the model itself changes (a worker pool needs a restart)
+		modelChanged = applicationChanged & DETECTOR_SETTINGS or ('inferenceImgsz' in applicationChanged and new.application.inferenceBackend in utils.STATIC_BACKENDS)
+		if isinstance(detector, utils.InferencePool):
+			if modelChanged or applicationChanged & {'inferenceConf', 'inferenceBatchSize'}:
+				print('Inference settings of the worker pool are applied at the next restart')
+		elif modelChanged:
+			exportModel(new.application, pipeline is not None)
+			newDetector = utils.YoloDetector(**detectorArgs(new.application))
+		
+		# Predictor: new model, horizon or number of cameras
+		if applicationChanged & {'predictorPath', 'predictionHorizon'} or len(new.cameras) != len(old.cameras):
+			newPredictor = utils.CountPredictor(new.application.predictorPath, len(new.cameras), new.application.predictionHorizon)
+		
+		# Endpoints
+		if influxChanged - {'urlAdriabus', 'adriabusConnectTimeout', 'adriabusReadTimeout'}:
+			newManager = utils.InfluxManager(new.influx, outbox, events)
+	except Exception as e:
+		events.error('config', 'Error while applying configuration, keeping the running one', e)
+		return
+	
+	cfg = new
+	
+	detectorChanged = newDetector is not detector
+	detector = newDetector
+	if not detectorChanged and not isinstance(detector, utils.InferencePool) and applicationChanged & INFERENCE_SETTINGS:
+		detector.conf = new.application.inferenceConf
+		detector.imgsz = new.application.inferenceImgsz
+		detector.batchSize = new.application.inferenceBatchSize
+	
+	predictor = newPredictor
+	
+	if newManager is not manager:
+		previous = manager
+		manager = newManager
+		publisher.manager = manager
+		outbox.register('influx', manager.writeLines, new.application.outboxDrainBatch)
+		previous.close()
+	elif 'outboxDrainBatch' in applicationChanged:
+		outbox.register('influx', manager.writeLines, new.application.outboxDrainBatch)
+	
+	adriabus.url = new.influx.urlAdriabus
+	adriabus.timeout = (new.influx.adriabusConnectTimeout, new.influx.adriabusReadTimeout)
+	adriabus.health.minBackoff = new.influx.retryInterval
+	adriabus.health.maxBackoff = new.influx.maxBackoff
+	
+	if applicationChanged & RECOVERY_SETTINGS:
+		updateHealth(detectorHealth)
+	
+	# Cameras
+	for i, settings in enumerate(new.cameras):
+		if i < len(cameras):
+			cameras[i].update(settings, applicationChanged, detectorChanged)
+		else:
+			cameras.append(Camera(i, settings))
+	
+	for camera in cameras[len(new.cameras):]:
+		camera.grabber.stop()
+	del cameras[len(new.cameras):]
+	
+	if applicationChanged & RESTART_SETTINGS:
+		print(f'Applied at the next restart: {sorted(applicationChanged & RESTART_SETTINGS)}')
+
+#============================================================================== Application
+
+print('===== BUS SENSOR =====')
+
+# The model is exported (if needed) before it is loaded, the exporter thread is over before the workers are forked
+exportModel(cfg.application, True)
+
+# Worker processes are forked first, before any other thread is started. The watchdog device is closed
+# meanwhile: it can be opened only once, and a descriptor inherited by the workers would keep it busy.
+if cfg.application.inferenceWorkers > 0:
 	wtd.close()
+	pool = utils.InferencePool(cfg.application.inferenceWorkers, detectorArgs(cfg.application))
+	wtd.open()
+	wtd.timeout = 300
+
+# Structured event log, written in batches
+events = utils.EventLog(
+	cfg.application.logFilePath,
+	cfg.application.logMaxSize,
+	cfg.application.logBackups,
+	cfg.application.logRingSize,
+	cfg.application.logFlushInterval
+)
+events.start()
+
+# Local spool for measurements that could not be sent
+outbox = utils.Outbox(
+	cfg.application.outboxPath,
+	cfg.application.outboxMaxSize,
+	cfg.application.outboxMaxAge,
+	cfg.application.outboxDrainInterval,
+	events
+)
+
+# Inference model (shared by all the cameras), bus counter predictor (one batch row per camera)
+# and InfluxDB manager are loaded at the same time
+with ThreadPoolExecutor(3) as loader:
+	if cfg.application.inferenceWorkers > 0:
+		detectorLoad = loader.submit(lambda: pool)
+	else:
+		detectorLoad = loader.submit(utils.YoloDetector, **detectorArgs(cfg.application))
+	predictorLoad = loader.submit(utils.CountPredictor, cfg.application.predictorPath, len(cfg.cameras), cfg.application.predictionHorizon)
+	managerLoad = loader.submit(utils.InfluxManager, cfg.influx, outbox, events)
 	
-	# Sleep
-	time.sleep(waitTime)
+	detector = detectorLoad.result()
+	detectorHealth = createHealth('detector')
+	loadTime = time.monotonic() - startTime
+	
+	# Warm-up inference while the other components finish loading
+	if cfg.application.warmupImage:
+		try:
+			detector.warmUp(cfg.application.warmupImage)
+		except Exception as e:
+			events.error('warmup', 'Warm-up skipped', e)
+	warmupTime = time.monotonic() - startTime - loadTime
+	
+	predictor = predictorLoad.result()
+	manager = managerLoad.result()
+
+# Adriabus publisher
+adriabus = utils.AdriabusPublisher(
+	cfg.influx.urlAdriabus,
+	cfg.influx.adriabusConnectTimeout,
+	cfg.influx.adriabusReadTimeout,
+	outbox,
+	events,
+	cfg.influx.retryInterval,
+	cfg.influx.maxBackoff
+)
+
+# Sends run off the main loop, one publisher for all the cameras
+publisher = utils.Publisher(manager, adriabus, cfg.application.publisherWorkers)
+
+# Replay the spooled backlog once the endpoints are back
+outbox.register('influx', manager.writeLines, cfg.application.outboxDrainBatch)
+outbox.register('adriabus', lambda payloads: adriabus.post(json.loads(payloads[0])), 1)
+outbox.start()
+
+# Annotated snapshots of the last cycles, served on request
+snapshots = utils.SnapshotRing(cfg.application.snapshotRingSize)
+if cfg.application.snapshotPort > 0:
+	snapshotServer = utils.SnapshotServer(
+		snapshots,
+		cfg.application.snapshotHost,
+		cfg.application.snapshotPort,
+		cfg.application.snapshotQuality,
+		cfg.application.snapshotScale,
+		cfg.application.previewFps
+	)
+	snapshotServer.start()
+
+# Clean shutdown: the loop ends on SIGTERM (systemctl stop), SIGINT (Ctrl-C) or 'q' in the display window
+def stopRunning(signum = None, frame = None):
+	global running
+	running = False
+
+signal.signal(signal.SIGTERM, stopRunning)
+signal.signal(signal.SIGINT, stopRunning)
+
+############################################################ START DISPLAY
+if useDisplay:
+	# Own thread, never stalls the loop
+	preview = utils.PreviewWindow(snapshots, cfg.application.previewFps, cfg.application.snapshotScale, stopRunning)
+	preview.start()
+############################################################ END DISPLAY
+
+# Cameras
+cameras = [Camera(i, settings) for i, settings in enumerate(cfg.cameras)]
+for camera in cameras:
+	if isinstance(camera.scheduler, utils.LinearScheduler):
+		print(f'Camera {camera.index} - M: {camera.scheduler.m}\t\tQ: {camera.scheduler.q}')
+
+# Hot reload on SIGHUP or when the file changes
+watcher = utils.ConfigWatcher(CONFIG_PATH)
+
+wtd.close()
+
+# Whatever ends the loop, the queues are drained and the resources released
+try:
+	if cfg.application.runMode == 'pipeline':
+		# Capture, inference and prediction/send stages connected by bounded queues: the burst of a camera
+		# is acquired while the previous one is still being inferred, and published while the next one is
+		pipeline = utils.Pipeline([
+			utils.Stage('capture', acquireBurst, 1, 'block', None, dropBurst, events),
+			utils.Stage('inference', inferBurst, cfg.application.pipelineQueueSize, cfg.application.pipelineDropPolicy, cfg.application.pipelineMaxJobAge, dropBurst, events),
+			utils.Stage('publish', publishBurst, cfg.application.pipelineQueueSize, 'block', None, dropBurst, events)
+		])
+		pipeline.start()
+		
+		# The watchdog is fed as long as no stage is stuck and no reboot has been requested
+		wtd.open()
+		wtd.timeout = 300
+		
+		try:
+			while running:
+				if watcher.changed() or pendingReload:
+					reloadSettings()
+				
+				if not pipeline.stalled(cfg.application.pipelineStallTimeout):
+					feedWatchdog()
+				
+				# Cameras which are due, first the most late; stop when the capture stage is busy.
+				# No new burst while a reload is deferred, so the ones in flight can complete.
+				now = time.time()
+				for camera in sorted(cameras, key = lambda c: c.nextDue):
+					if pendingReload:
+						break
+					if camera.inFlight or camera.nextDue > now:
+						continue
+					camera.inFlight = True
+					if not pipeline.offer(camera):
+						camera.inFlight = False
+						break
+				
+				idle = [c.nextDue for c in cameras if not c.inFlight]
+				time.sleep(min(1, max(0.05, min(idle, default = now + 1) - time.time())))
+		finally:
+			# Bursts in flight are completed
+			pipeline.stop()
+			wtd.close()
+	else:
+		# Application loop: bursts of the camera which is due first
+		while running:
+			if watcher.changed() or pendingReload:
+				reloadSettings()
+			
+			camera = min(cameras, key = lambda c: c.nextDue)
+			
+			# Sleep (in short steps, to pick up a reload)
+			delay = camera.nextDue - time.time()
+			if delay > 0:
+				time.sleep(min(delay, 1))
+				continue
+			
+			# Watchdog open
+			wtd.open()
+			wtd.timeout = 300
+			
+			try:
+				runCycle(camera)
+			finally:
+				# Watchdog closed
+				wtd.close()
+finally:
+	# Measurements still queued are written (or spooled), then the outbox, the log and the inference workers are closed
+	publisher.close()
+	outbox.stop()
+	events.close()
+	if isinstance(detector, utils.InferencePool):
+		detector.close()
@@ -1,36 +1,2036 @@
 import json
-import influxdb_client
-from influxdb_client.client.write_api import SYNCHRONOUS
+import signal
+import http.server
+import urllib.parse
+import math
+import os
+import queue
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+import threading
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# Heavy modules (ultralytics/torch, tflite_runtime, influxdb_client, requests) are imported
+# by the components that need them, so startup can load them in parallel
 
 # Configuration reader
 def loadConfig(filename):
     with open(filename, "r") as file:
         return json.load(file)
 
-# InfluxDB Manager
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Image files given directly or found in the given directories
+def listFrames(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+# Structured event log: JSON records kept in an in-memory ring and appended to the file in batches
+# by a background thread (few writes on the SD card), with size-based rotation.
+# Errors and retries are also counted per stage, to be published with the other metrics.
+class EventLog:
+    def __init__(self, path, maxSize: int = 1000000, backups: int = 3, ringSize: int = 1000, flushInterval: float = 60):
+        self.path = path
+        self.maxSize = maxSize
+        self.backups = backups
+        self.flushInterval = flushInterval
+
+        # Records not yet on disk: the oldest are dropped if the ring fills up before a flush
+        self.pending = collections.deque(maxlen = ringSize)
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+        # (kind, stage) -> count
+        self.counts = collections.Counter()
+
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def event(self, level: str, stage: str, message: str, exception: Exception = None, **context):
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'level': level, 'stage': stage, 'message': message}
+        if exception is not None:
+            record['exception'] = type(exception).__name__
+            record['detail'] = str(exception)
+        record.update(context)
+
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(record)
+            if level in ('error', 'retry'):
+                self.counts[(level, stage)] += 1
+
+    def info(self, stage: str, message: str, **context):
+        self.event('info', stage, message, **context)
+
+    def retry(self, stage: str, message: str, exception: Exception = None, **context):
+        self.event('retry', stage, message, exception, **context)
+
+    def error(self, stage: str, message: str, exception: Exception = None, **context):
+        self.event('error', stage, message, exception, **context)
+
+    # Influx fields: errors-<stage> and retries-<stage>, cumulative since startup
+    def counters(self):
+        with self.lock:
+            fields = {f"{'errors' if level == 'error' else 'retries'}-{stage}": count for (level, stage), count in self.counts.items()}
+            if self.dropped:
+                fields['log-dropped'] = self.dropped
+            return fields
+
+    def start(self):
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target = self._run, name = 'event-log', daemon = True)
+        self.thread.start()
+
+    # Stop the writer and write what is still pending
+    def close(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            records = list(self.pending)
+            self.pending.clear()
+        if not records:
+            return
+
+        # Context values that are not JSON (numpy scalars, exceptions, paths) are written as text
+        data = ''.join(json.dumps(r, default = str) + '\n' for r in records)
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.maxSize:
+                self._rotate()
+            with open(self.path, 'a') as file:
+                file.write(data)
+        except OSError:
+            # Nowhere to report it: the records are lost, the counters are not
+            with self.lock:
+                self.dropped += len(records)
+
+    # errors.log -> errors.log.1 -> ... -> errors.log.<backups>, the oldest is removed
+    def _rotate(self):
+        if self.backups == 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        os.replace(self.path, f'{self.path}.1')
+
+    def _run(self):
+        while not self.stopEvent.wait(self.flushInterval):
+            self.flush()
+
+# Health of a subsystem: ok, degraded while it fails and is retried with exponential backoff and jitter,
+# failed once it has been failing for longer than the budget (None: never). Any success brings it back to ok.
+class Health:
+    STATES = ('ok', 'degraded', 'failed')
+
+    def __init__(self, name, minBackoff: float = 1, maxBackoff: float = 60, budget: float = None, log = None):
+        self.name = name
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.budget = budget
+        self.log = log
+
+        self.lock = threading.Lock()
+        self.state = 'ok'
+        self.failures = 0
+        self.failingSince = None
+        self.retryAt = 0.0
+        self.recoveries = 0
+
+    def success(self):
+        with self.lock:
+            if self.state == 'ok':
+                return
+            failures = self.failures
+            self.state = 'ok'
+            self.failures = 0
+            self.failingSince = None
+            self.retryAt = 0.0
+            self.recoveries += 1
+
+        if self.log is not None:
+            self.log.info(self.name, 'Recovered', failures = failures)
+
+    # Record a failure and return the seconds to wait before the next attempt
+    def failure(self, exception: Exception = None):
+        now = time.monotonic()
+        with self.lock:
+            self.failures += 1
+            if self.failingSince is None:
+                self.failingSince = now
+
+            delay = min(self.maxBackoff, self.minBackoff * 2 ** (self.failures - 1))
+            delay = random.uniform(delay / 2, delay)
+            self.retryAt = now + delay
+
+            exhausted = self.budget is not None and now - self.failingSince >= self.budget
+            self.state = 'failed' if exhausted else 'degraded'
+
+        if self.log is not None:
+            self.log.retry(self.name, f'Failure {self.failures}, next attempt in {delay:.1f} s', exception, state = self.state)
+        return delay
+
+    # Backoff elapsed: the next attempt can be made
+    def ready(self):
+        return time.monotonic() >= self.retryAt
+
+    @property
+    def failed(self):
+        return self.state == 'failed'
+
+    # Influx field: 0 ok, 1 degraded, 2 failed
+    def fields(self):
+        return {f'health-{self.name}': self.STATES.index(self.state)}
+
+# InfluxDB Manager: points are queued and written in batches by a background thread
 class InfluxManager:
-    def __init__(self, config):
-        self.cfg = config
+    def __init__(self, settings, outbox = None, log = None):
+        self.settings = settings
+
+        # Points that cannot be delivered are spooled here
+        self.outbox = outbox
+        self.log = log
+        self.health = Health('influx', settings.retryInterval, settings.maxBackoff, log = log)
+
+        self._connect()
+
+        # Default tags, built once
+        self.tags = self.buildTags(settings.host, settings.location, settings.room)
+
+        # Writer settings
+        self.batchSize = settings.batchSize
+        self.flushInterval = settings.flushInterval
+        self.maxRetries = settings.maxRetries
+        self.retryInterval = settings.retryInterval
+
+        # Bounded queue: when full the oldest points are moved to the overflow, spooled by the writer thread
+        self.queue = collections.deque(maxlen = settings.queueSize)
+        self.overflow = []
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.failed = 0
+        self.stats = EndpointStats()
+
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target = self._run, name = 'influx-writer', daemon = True)
+        self.thread.start()
+
+    def _connect(self):
+        import influxdb_client
+        from influxdb_client.client.write_api import SYNCHRONOUS
 
         self.client = influxdb_client.InfluxDBClient(
-            url = self.cfg['influx']['url'],
-            org = self.cfg['influx']['org'],
-            token = self.cfg['influx']['token']
+            url = self.settings.url,
+            org = self.settings.org,
+            token = self.settings.token
         )
 
         self.apiWriter = self.client.write_api(write_options = SYNCHRONOUS)
 
-    def sendCount(self, count: int):
-        task = "monitor_task,host={},location={},room={}".format(self.cfg['influx']['host'],self.cfg['influx']['location'],self.cfg['influx']['room'])
-        sequence = [str(task) + " bus-stop-count=" + str(count),]
-        self.apiWriter.write(bucket = self.cfg['influx']['bucket'], org = self.cfg['influx']['org'], record = sequence)
-    
-    def sendDelta(self, delta: int):
-        task = "monitor_task,host={},location={},room={}".format(self.cfg['influx']['host'],self.cfg['influx']['location'],self.cfg['influx']['room'])
-        sequence = [str(task) + " bus-stop-delta=" + str(delta),]
-        self.apiWriter.write(bucket = self.cfg['influx']['bucket'], org = self.cfg['influx']['org'], record = sequence)
-    
-    def sendPrediction(self, prediction: int):
-        task = "monitor_task,host={},location={},room={}".format(self.cfg['influx']['host'],self.cfg['influx']['location'],self.cfg['influx']['room'])
-        sequence = [str(task) + " bus-stop-prediction=" + str(prediction),]
-        self.apiWriter.write(bucket = self.cfg['influx']['bucket'], org = self.cfg['influx']['org'], record = sequence)
\ No newline at end of file
+    # New client, in case the old connections are stuck
+    def _reconnect(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+        self._connect()
+
+    # Tag set of a camera, to be built once and passed with its points
+    def buildTags(self, host, location, room):
+        return ",host={},location={},room={}".format(host, location, room)
+
+    # Line protocol point with all the fields of one cycle, timestamped at capture time
+    def buildPoint(self, fields: dict, timestamp: float = None, measurement: str = 'monitor_task', tags: str = None):
+        line = measurement + (self.tags if tags is None else tags) + " " + ",".join(f"{key}={value}" for key, value in fields.items())
+        if timestamp is not None:
+            line += " " + str(int(timestamp * 1e9))
+        return line
+
+    # Queue a point for the background writer (never blocks)
+    def send(self, fields: dict, timestamp: float = None, measurement: str = 'monitor_task', tags: str = None):
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.overflow.append(self.queue.popleft())
+                self.dropped += 1
+            self.queue.append(self.buildPoint(fields, timestamp, measurement, tags))
+            if len(self.queue) >= self.batchSize:
+                self.condition.notify()
+
+    # Blocking write of a list of line protocol points
+    def writeLines(self, lines):
+        self.apiWriter.write(bucket = self.settings.bucket, org = self.settings.org, record = lines)
+
+    # Write everything still queued and stop the writer
+    def close(self):
+        self.stopEvent.set()
+        with self.condition:
+            self.condition.notify()
+        self.thread.join()
+        self.client.close()
+
+    def _takeBatch(self):
+        with self.condition:
+            batch = []
+            while self.queue and len(batch) < self.batchSize:
+                batch.append(self.queue.popleft())
+            return batch
+
+    def _writeBatch(self, batch):
+        # Endpoint down: spool without waiting for timeouts until its backoff has elapsed
+        if not self.health.ready():
+            self.failed += len(batch)
+            self._spill(batch)
+            return False
+
+        delay = self.retryInterval
+        for attempt in range(self.maxRetries + 1):
+            start = time.perf_counter()
+            try:
+                self.writeLines(batch)
+                self.stats.record(time.perf_counter() - start, True)
+                self.health.success()
+                return True
+            except Exception as e:
+                self.stats.record(time.perf_counter() - start, False)
+                if attempt == self.maxRetries or self.stopEvent.wait(delay):
+                    error = e
+                    break
+                if self.log is not None:
+                    self.log.retry('influx', 'Write failed, retrying', e, attempt = attempt + 1, points = len(batch))
+                delay *= 2
+
+        if self.log is not None:
+            self.log.error('influx', 'Write failed, batch spooled', error, points = len(batch))
+        self.failed += len(batch)
+        self._spill(batch)
+
+        # Back off, then retry on a fresh connection
+        self.health.failure(error)
+        self._reconnect()
+        return False
+
+    def _spill(self, lines):
+        if self.outbox is not None:
+            self.outbox.put('influx', lines)
+
+    def _spillOverflow(self):
+        with self.condition:
+            lines, self.overflow = self.overflow, []
+        if lines:
+            self._spill(lines)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if len(self.queue) < self.batchSize and not self.stopEvent.is_set():
+                    self.condition.wait(self.flushInterval)
+
+            self._spillOverflow()
+            batch = self._takeBatch()
+            while batch:
+                self._writeBatch(batch)
+                self._spillOverflow()
+                batch = self._takeBatch() if len(self.queue) >= self.batchSize or self.stopEvent.is_set() else []
+
+            if self.stopEvent.is_set():
+                break
+
+# Per-endpoint delivery statistics
+class EndpointStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.failures = 0
+        self.lastLatency = 0.0
+        self.totalLatency = 0.0
+
+    def record(self, latency: float, success: bool):
+        with self.lock:
+            self.lastLatency = latency
+            self.totalLatency += latency
+            if success:
+                self.sent += 1
+            else:
+                self.failures += 1
+
+    def snapshot(self):
+        with self.lock:
+            attempts = self.sent + self.failures
+            return {
+                'sent': self.sent,
+                'failures': self.failures,
+                'latency-last': self.lastLatency,
+                'latency-avg': self.totalLatency / attempts if attempts else 0.0
+            }
+
+# Adriabus publisher: persistent keep-alive session with connect and read timeouts
+class AdriabusPublisher:
+    def __init__(self, url, connectTimeout: float, readTimeout: float, outbox = None, log = None, minBackoff: float = 2, maxBackoff: float = 300):
+        self.url = url
+        self.timeout = (connectTimeout, readTimeout)
+        self.outbox = outbox
+        self.log = log
+        self.health = Health('adriabus', minBackoff, maxBackoff, log = log)
+
+        import requests
+        self.requests = requests
+        self.session = requests.Session()
+        self.stats = EndpointStats()
+
+    # Blocking push (raises on any failure); a failure drops the pooled connections
+    def post(self, payload: dict):
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(self.url, json = payload, timeout = self.timeout)
+            resp.raise_for_status()
+        except Exception as e:
+            self.stats.record(time.perf_counter() - start, False)
+            self.health.failure(e)
+            self.session.close()
+            self.session = self.requests.Session()
+            raise
+
+        self.stats.record(time.perf_counter() - start, True)
+        self.health.success()
+        return resp
+
+    # Push, spooling the payload if Adriabus is not reachable (or still backing off)
+    def publish(self, payload: dict):
+        try:
+            if not self.health.ready():
+                raise Exception("Adriabus backing off")
+            self.post(payload)
+        except Exception as e:
+            if self.log is not None:
+                self.log.error('adriabus', 'Push failed, payload spooled', e)
+            if self.outbox is not None:
+                self.outbox.put('adriabus', [json.dumps(payload)])
+
+    def close(self):
+        self.session.close()
+
+# Publisher: the main loop only hands off each cycle's measurement.
+# The Influx point goes to the batching writer and the Adriabus push runs on a small worker pool, at the same time.
+class Publisher:
+    def __init__(self, manager, adriabus, workers: int = 2):
+        self.manager = manager
+        self.adriabus = adriabus
+        self.pool = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'publisher')
+
+    def publish(self, fields: dict, timestamp: float = None, payload: dict = None, measurement: str = 'monitor_task', tags: str = None):
+        self.manager.send(fields, timestamp, measurement, tags)
+        if payload is not None:
+            self.pool.submit(self.adriabus.publish, payload)
+
+    def stats(self):
+        return {'influx': self.manager.stats.snapshot(), 'adriabus': self.adriabus.stats.snapshot()}
+
+    def close(self):
+        self.pool.shutdown(wait = True)
+        self.adriabus.close()
+        self.manager.close()
+
+# Outbox: durable on-disk spool (SQLite) of the measurements that could not be delivered.
+# A background drainer replays the backlog in bulk through the handler registered for each kind.
+class Outbox:
+    def __init__(self, path, maxSize: int, maxAge: float, drainInterval: float = 30, log = None):
+        self.maxSize = maxSize
+        self.maxAge = maxAge
+        self.drainInterval = drainInterval
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload TEXT NOT NULL, created REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS outbox_kind ON outbox (kind, id)')
+
+        # Total payload size and row count, kept up to date on every insert and delete (one scan at startup)
+        self.size, self.rows = self.db.execute('SELECT COALESCE(SUM(LENGTH(payload)), 0), COUNT(*) FROM outbox').fetchone()
+
+        # kind -> (handler, batch size)
+        self.handlers = {}
+        self.evicted = 0
+        self.replayed = 0
+        self.log = log
+
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    # The handler receives a list of payloads and must raise if they were not delivered
+    def register(self, kind: str, handler, batchSize: int = 500):
+        self.handlers[kind] = (handler, batchSize)
+
+    def put(self, kind: str, payloads):
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN')
+            self.db.executemany('INSERT INTO outbox (kind, payload, created) VALUES (?, ?, ?)', [(kind, p, now) for p in payloads])
+            self.db.execute('COMMIT')
+            self.size += sum(len(p) for p in payloads)
+            self.rows += len(payloads)
+            self._evictSize()
+
+    def pending(self):
+        with self.lock:
+            return self.rows
+
+    # Influx fields: backlog and what was dropped or delivered since startup
+    def fields(self):
+        with self.lock:
+            return {'outbox-pending': self.rows, 'outbox-bytes': self.size, 'outbox-evicted': self.evicted, 'outbox-replayed': self.replayed}
+
+    def start(self):
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target = self._run, name = 'outbox-drainer', daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Age based eviction: rows are in creation order, so only the expired ones are read (caller holds the lock)
+    def _evictAge(self):
+        first = self.db.execute('SELECT id FROM outbox WHERE created >= ? ORDER BY id LIMIT 1', (time.time() - self.maxAge,)).fetchone()
+        condition, args = ('id < ?', (first[0],)) if first else ('1', ())
+
+        length, count = self.db.execute(f'SELECT COALESCE(SUM(LENGTH(payload)), 0), COUNT(*) FROM outbox WHERE {condition}', args).fetchone()
+        if count:
+            self.db.execute(f'DELETE FROM outbox WHERE {condition}', args)
+            self.size -= length
+            self._evicted(count, f'older than {self.maxAge:g} s')
+
+    # Size based eviction, oldest first, only as many rows as needed (caller holds the lock)
+    def _evictSize(self):
+        while self.size > self.maxSize:
+            rows = self.db.execute('SELECT id, LENGTH(payload) FROM outbox ORDER BY id LIMIT 100').fetchall()
+            if not rows:
+                self.size = 0
+                self.rows = 0
+                break
+            count = 0
+            for last, length in rows:
+                self.size -= length
+                count += 1
+                if self.size <= self.maxSize:
+                    break
+            self.db.execute('DELETE FROM outbox WHERE id <= ?', (last,))
+            self._evicted(count, f'over {self.maxSize} bytes')
+
+    # Evicted rows are lost measurements: counted and logged (caller holds the lock)
+    def _evicted(self, count, reason):
+        self.rows -= count
+        self.evicted += count
+        if self.log is not None:
+            self.log.error('outbox', f'Spooled measurements evicted ({reason})', rows = count, evicted = self.evicted)
+
+    # Replay one kind until it is empty or its endpoint fails again
+    def _drain(self, kind, handler, batchSize):
+        while not self.stopEvent.is_set():
+            with self.lock:
+                rows = self.db.execute('SELECT id, payload FROM outbox WHERE kind = ? ORDER BY id LIMIT ?', (kind, batchSize)).fetchall()
+            if not rows:
+                return
+
+            try:
+                handler([r[1] for r in rows])
+            except Exception as e:
+                if self.log is not None:
+                    self.log.retry('outbox', f'Replay of {kind} failed, retrying at the next drain', e, rows = len(rows))
+                return
+
+            with self.lock:
+                # Rows evicted meanwhile are not counted twice
+                length, count = self.db.execute('SELECT COALESCE(SUM(LENGTH(payload)), 0), COUNT(*) FROM outbox WHERE kind = ? AND id <= ?', (kind, rows[-1][0])).fetchone()
+                self.db.execute('DELETE FROM outbox WHERE kind = ? AND id <= ?', (kind, rows[-1][0]))
+                self.size -= length
+                self.rows -= count
+                self.replayed += len(rows)
+
+    def _run(self):
+        while not self.stopEvent.wait(self.drainInterval):
+            with self.lock:
+                self._evictAge()
+                self._evictSize()
+
+            for kind, (handler, batchSize) in list(self.handlers.items()):
+                self._drain(kind, handler, batchSize)
+
+# Inference backends and the ultralytics export format each of them loads
+BACKENDS = {
+    'pytorch': None,
+    'onnx': 'onnx',
+    'openvino': 'openvino',
+    'onnx-int8': 'onnx',
+    'openvino-int8': 'openvino',
+    'tflite-int8': 'tflite'
+}
+
+# INT8 models need calibration frames: they are built by quantize.py, never exported on the fly
+INT8_BACKENDS = ('onnx-int8', 'openvino-int8', 'tflite-int8')
+
+# Backends whose model has a fixed input size (inference-imgsz)
+STATIC_BACKENDS = ('tflite-int8',)
+
+# Path of the artifact exported for a backend, cached next to the .pt model
+def exportedModelPath(modelPath, backend):
+    base = os.path.splitext(modelPath)[0]
+
+    if backend == 'onnx':
+        return base + '.onnx'
+    if backend == 'openvino':
+        return base + '_openvino_model'
+    if backend == 'onnx-int8':
+        return base + '_int8.onnx'
+    if backend == 'openvino-int8':
+        return base + '_int8_openvino_model'
+    if backend == 'tflite-int8':
+        return base + '_int8.tflite'
+    return modelPath
+
+# Convert the .pt model into the backend format (only if not already cached)
+def exportModel(modelPath, backend, imgsz: int = 640):
+    if backend not in BACKENDS:
+        raise Exception(f"Unknown inference backend: {backend}")
+
+    artifact = exportedModelPath(modelPath, backend)
+    if backend in INT8_BACKENDS:
+        if not os.path.exists(artifact):
+            raise Exception(f"INT8 model not found: {artifact} (build it with quantize.py)")
+    elif BACKENDS[backend] is not None and not os.path.exists(artifact):
+        from ultralytics import YOLO
+
+        # Exported from a copy in a scratch directory and moved into place only once complete:
+        # an interrupted export never leaves a partial artifact that looks cached
+        with tempfile.TemporaryDirectory(prefix = '.export-', dir = os.path.dirname(os.path.abspath(modelPath))) as scratch:
+            copy = shutil.copy(modelPath, scratch)
+            exported = YOLO(copy).export(format = BACKENDS[backend], imgsz = imgsz, dynamic = True)
+            os.replace(exported, artifact)
+
+    return artifact
+
+# Person detector interface: every backend returns the same counts and boxes
+class Detector:
+    # Returns the person count and the xyxy boxes of every frame.
+    # imgsz: model input size of this call (None: the configured one)
+    def detect(self, frames, imgsz: int = None):
+        raise NotImplementedError
+
+    # Shape of the image the model sees for a frame of the given shape
+    def inputShape(self, frameShape):
+        return frameShape[:2]
+
+    # Run one inference on a sample image so the first real burst does not pay for lazy initialization
+    def warmUp(self, imagePath):
+        frame = cv2.imread(imagePath)
+        if frame is None:
+            raise Exception(f"Unable to read warm-up image: {imagePath}")
+        self.detect([frame])
+
+# YOLO detector: PyTorch model or its ONNX Runtime / OpenVINO export, runs a whole burst in batches
+class YoloDetector(Detector):
+    def __init__(self, modelPath, conf: float, backend: str = 'pytorch', batchSize: int = 4, imgsz: int = 640):
+        self.backend = backend
+        self.conf = conf
+        self.batchSize = max(1, batchSize)
+        self.imgsz = imgsz
+
+        # Exported models run on the CPU engines (ONNX Runtime, OpenVINO), PyTorch picks its device (GPU if any)
+        self.device = None if backend == 'pytorch' else 'cpu'
+
+        from ultralytics import YOLO
+
+        if backend == 'pytorch':
+            self.model = YOLO(modelPath)
+        else:
+            self.model = YOLO(exportModel(modelPath, backend, imgsz), task = 'detect')
+
+    def detect(self, frames, imgsz: int = None):
+        counts = []
+        boxes = []
+
+        for i in range(0, len(frames), self.batchSize):
+            results = self.model(list(frames[i:i + self.batchSize]), classes = [0], conf = self.conf, imgsz = imgsz or self.imgsz, device = self.device)
+
+            for r in results:
+                xyxy = r.boxes.xyxy.cpu().numpy().astype(np.float32)
+                counts.append(len(xyxy))
+                boxes.append(xyxy)
+
+        return counts, boxes
+
+# Inference worker process: holds its own detector and reads the frames from a shared memory segment
+def _inferenceWorker(detectorArgs, threads, tasks, results):
+    import torch
+    torch.set_num_threads(threads)
+
+    detector = YoloDetector(**detectorArgs)
+    segment = None
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        taskId, name, shapes, imgsz = task
+
+        # Attach again only when the parent has replaced the segment
+        if segment is None or segment.name != name:
+            if segment is not None:
+                segment.close()
+            segment = shared_memory.SharedMemory(name = name)
+
+        frames = []
+        offset = 0
+        for shape in shapes:
+            frames.append(np.ndarray(shape, dtype = np.uint8, buffer = segment.buf, offset = offset))
+            offset += int(np.prod(shape))
+
+        try:
+            counts, boxes = detector.detect(frames, imgsz)
+            results.put((taskId, counts, boxes, None))
+        except Exception as e:
+            results.put((taskId, None, None, repr(e)))
+
+        # Views must be gone before the segment can be closed
+        del frames
+
+    if segment is not None:
+        segment.close()
+
+# Pool of inference processes, each one with a loaded detector. Frames are handed over through
+# shared memory (one segment per worker) and only counts and boxes come back.
+class InferencePool(Detector):
+    def __init__(self, workers: int, detectorArgs: dict, segmentSize: int = 4 * 1920 * 1080 * 3, timeout: float = 120):
+        # fork: the sensor is a script and must not be re-imported by the workers.
+        # Create the pool before starting any other thread (and with no device such as the watchdog open).
+        context = multiprocessing.get_context('fork')
+        self.timeout = timeout
+        threads = max(1, os.cpu_count() // workers)
+
+        # Exported once here: the workers only load the finished artifact, never export it side by side
+        exportModel(detectorArgs['modelPath'], detectorArgs.get('backend', 'pytorch'), detectorArgs.get('imgsz', 640))
+
+        self.lock = threading.Lock()
+        self.results = context.Queue()
+        self.tasks = []
+        self.segments = []
+        self.processes = []
+        self.taskId = 0
+
+        for i in range(workers):
+            self.tasks.append(context.Queue())
+            self.segments.append(shared_memory.SharedMemory(create = True, size = segmentSize))
+
+            process = context.Process(target = _inferenceWorker, args = (detectorArgs, threads, self.tasks[i], self.results), name = f'inference-{i}', daemon = True)
+            process.start()
+            self.processes.append(process)
+
+    # Copy the frames into the worker segment, growing it if they do not fit
+    def _write(self, worker, frames):
+        size = sum(f.nbytes for f in frames)
+        if size > self.segments[worker].size:
+            self.segments[worker].close()
+            self.segments[worker].unlink()
+            self.segments[worker] = shared_memory.SharedMemory(create = True, size = size)
+
+        segment = self.segments[worker]
+        offset = 0
+        for f in frames:
+            np.ndarray(f.shape, dtype = np.uint8, buffer = segment.buf, offset = offset)[:] = f
+            offset += f.nbytes
+
+        return segment.name
+
+    # The burst is split across the workers, which run in parallel
+    def detect(self, frames, imgsz: int = None):
+        with self.lock:
+            chunks = [c for c in np.array_split(np.arange(len(frames)), len(self.processes)) if len(c)]
+            pending = {}
+
+            for worker, chunk in enumerate(chunks):
+                chunkFrames = [np.ascontiguousarray(frames[i], dtype = np.uint8) for i in chunk]
+                name = self._write(worker, chunkFrames)
+
+                self.taskId += 1
+                pending[self.taskId] = worker
+                self.tasks[worker].put((self.taskId, name, [f.shape for f in chunkFrames], imgsz))
+
+            # A worker that died (e.g. killed for memory) or hangs is reported, so the caller can recover
+            deadline = time.monotonic() + self.timeout
+            done = {}
+            while len(done) < len(pending):
+                try:
+                    taskId, counts, boxes, error = self.results.get(timeout = 1)
+                except queue.Empty:
+                    dead = [p.name for p in self.processes if not p.is_alive()]
+                    if dead:
+                        raise Exception(f"Inference workers died: {', '.join(dead)}")
+                    if time.monotonic() > deadline:
+                        raise Exception(f"Inference timed out after {self.timeout} s")
+                    continue
+                if taskId not in pending:
+                    continue
+                if error is not None:
+                    raise Exception(f"Inference worker failed: {error}")
+                done[pending[taskId]] = (counts, boxes)
+
+            counts = []
+            boxes = []
+            for worker in range(len(chunks)):
+                counts += done[worker][0]
+                boxes += done[worker][1]
+            return counts, boxes
+
+    def close(self):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join()
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+
+# Region of interest: rectangles ({"rect": [x1, y1, x2, y2]}) and polygons ({"polygon": [[x, y], ...]})
+# of the frame where people are counted. Frames are cropped to the bounding box of the region and
+# everything outside it is masked.
+class RegionOfInterest:
+    def __init__(self, shapes):
+        self.polygons = []
+        for shape in shapes:
+            if 'rect' in shape:
+                x1, y1, x2, y2 = shape['rect']
+                points = [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+            elif 'polygon' in shape:
+                points = shape['polygon']
+            else:
+                raise Exception(f"Invalid ROI shape: {shape}")
+            self.polygons.append(np.array(points, dtype = np.int32))
+
+        if not self.polygons:
+            raise Exception("Empty ROI")
+
+        self.frameShape = None
+        self.mask = None
+
+    # Crop bounds and mask, built once per frame size
+    def _prepare(self, frameShape):
+        points = np.concatenate(self.polygons)
+        height, width = frameShape[:2]
+
+        self.x1 = int(np.clip(points[:, 0].min(), 0, width - 1))
+        self.y1 = int(np.clip(points[:, 1].min(), 0, height - 1))
+        self.x2 = int(np.clip(points[:, 0].max() + 1, self.x1 + 1, width))
+        self.y2 = int(np.clip(points[:, 1].max() + 1, self.y1 + 1, height))
+
+        self.mask = np.zeros((self.y2 - self.y1, self.x2 - self.x1), dtype = np.uint8)
+        cv2.fillPoly(self.mask, [p - (self.x1, self.y1) for p in self.polygons], 255)
+        self.frameShape = frameShape[:2]
+
+    def apply(self, frame):
+        if self.frameShape != frame.shape[:2]:
+            self._prepare(frame.shape)
+
+        crop = frame[self.y1:self.y2, self.x1:self.x2]
+        return cv2.bitwise_and(crop, crop, mask = self.mask)
+
+    # Boxes of a cropped frame back in frame coordinates, keeping only people standing inside the region
+    def filter(self, boxes):
+        if len(boxes) == 0:
+            return boxes
+
+        boxes = boxes + np.array([self.x1, self.y1, self.x1, self.y1], dtype = boxes.dtype)
+
+        # Bottom center of the box (the feet)
+        x = np.clip(((boxes[:, 0] + boxes[:, 2]) / 2).astype(int) - self.x1, 0, self.mask.shape[1] - 1)
+        y = np.clip(boxes[:, 3].astype(int) - self.y1, 0, self.mask.shape[0] - 1)
+
+        return boxes[self.mask[y, x] > 0]
+
+# Detector restricted to a region of interest: any detector runs on the cropped, masked frames
+class RegionDetector(Detector):
+    def __init__(self, detector, roi):
+        self.detector = detector
+        self.roi = roi
+
+    # The crop around the region
+    def inputShape(self, frameShape):
+        if self.roi.frameShape != frameShape[:2]:
+            self.roi._prepare(frameShape)
+        return self.detector.inputShape((self.roi.y2 - self.roi.y1, self.roi.x2 - self.roi.x1))
+
+    def detect(self, frames, imgsz: int = None):
+        _, boxes = self.detector.detect([self.roi.apply(f) for f in frames], imgsz)
+        boxes = [self.roi.filter(b) for b in boxes]
+        return [len(b) for b in boxes], boxes
+
+# Greedy IoU association of two sets of xyxy boxes: (index in a, index in b) pairs, best overlap first
+def matchBoxes(a, b, threshold: float):
+    if len(a) == 0 or len(b) == 0:
+        return []
+
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    areaA = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    areaB = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    iou = inter / (areaA[:, None] + areaB[None, :] - inter + 1e-9)
+
+    pairs = []
+    usedA, usedB = set(), set()
+    for flat in np.argsort(-iou, axis = None):
+        i, j = divmod(int(flat), len(b))
+        if iou[i, j] < threshold:
+            break
+        if i in usedA or j in usedB:
+            continue
+        pairs.append((i, j))
+        usedA.add(i)
+        usedB.add(j)
+    return pairs
+
+# Boxes of the previous frame moved by the median optical flow (Lucas-Kanade) of a 3x3 grid of points inside each of them.
+# A box whose points are all lost stays where it was.
+def propagateBoxes(prevGray, gray, boxes):
+    if len(boxes) == 0:
+        return boxes
+
+    fx, fy = np.meshgrid(np.array([0.25, 0.5, 0.75], dtype = np.float32), np.array([0.25, 0.5, 0.75], dtype = np.float32))
+    x = boxes[:, 0, None] + (boxes[:, 2] - boxes[:, 0])[:, None] * fx.ravel()
+    y = boxes[:, 1, None] + (boxes[:, 3] - boxes[:, 1])[:, None] * fy.ravel()
+    points = np.stack([x, y], axis = -1).reshape(-1, 1, 2).astype(np.float32)
+
+    moved, status, _ = cv2.calcOpticalFlowPyrLK(prevGray, gray, points, None, winSize = (21, 21), maxLevel = 3)
+    shift = (moved - points).reshape(len(boxes), -1, 2)
+    found = status.reshape(len(boxes), -1) == 1
+
+    boxes = boxes.copy()
+    for k in range(len(boxes)):
+        if found[k].any():
+            dx, dy = np.median(shift[k][found[k]], axis = 0)
+            boxes[k] += (dx, dy, dx, dy)
+    return boxes
+
+# Detector with tracking: the wrapped detector only runs on every k-th frame of the burst (in a single call),
+# boxes are carried to the frames in between by optical flow and associated by IoU. A person missed by a few
+# key frames is still counted (up to maxMisses), and each person is counted once in uniqueCount.
+# Tracks do not outlive a burst: bursts are minutes apart.
+class TrackingDetector(Detector):
+    def __init__(self, detector, keyInterval: int = 4, iouThreshold: float = 0.3, maxMisses: int = 1):
+        self.detector = detector
+        self.keyInterval = max(1, keyInterval)
+        self.iouThreshold = iouThreshold
+        self.maxMisses = maxMisses
+
+        # Last burst
+        self.uniqueCount = 0
+        self.keyFrames = 0
+
+    def inputShape(self, frameShape):
+        return self.detector.inputShape(frameShape)
+
+    def detect(self, frames, imgsz: int = None):
+        keys = list(range(0, len(frames), self.keyInterval))
+        _, detections = self.detector.detect([frames[i] for i in keys], imgsz)
+        detections = dict(zip(keys, detections))
+
+        # [box, consecutive missed key frames]
+        tracks = []
+        created = 0
+        counts, boxes = [], []
+        prevGray = None
+
+        for i, frame in enumerate(frames):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if tracks and prevGray is not None:
+                moved = propagateBoxes(prevGray, gray, np.array([t[0] for t in tracks], dtype = np.float32))
+                for track, box in zip(tracks, moved):
+                    track[0] = box
+
+            if i in detections:
+                found = detections[i]
+                pairs = matchBoxes(np.array([t[0] for t in tracks], dtype = np.float32).reshape(-1, 4), found, self.iouThreshold)
+                matchedTracks = {p[0] for p in pairs}
+                matchedDetections = {p[1] for p in pairs}
+
+                for t, d in pairs:
+                    tracks[t] = [found[d], 0]
+                for t, track in enumerate(tracks):
+                    if t not in matchedTracks:
+                        track[1] += 1
+
+                tracks = [t for t in tracks if t[1] <= self.maxMisses]
+                new = [[found[d], 0] for d in range(len(found)) if d not in matchedDetections]
+                tracks += new
+                created += len(new)
+
+            current = np.array([t[0] for t in tracks], dtype = np.float32).reshape(-1, 4)
+            counts.append(len(current))
+            boxes.append(current)
+            prevGray = gray
+
+        self.uniqueCount = created
+        self.keyFrames = len(keys)
+        return counts, boxes
+
+# Detector chain of a camera (sensor loop and benchmark): count only inside the region of interest,
+# if any; with tracking the model only runs on the key frames
+def cameraDetector(detector, roi, application):
+    if roi is not None:
+        detector = RegionDetector(detector, roi)
+    if application.trackingEnabled:
+        detector = TrackingDetector(detector, application.trackingKeyInterval, application.trackingIou, application.trackingMaxMisses)
+    return detector
+
+# Model input size of each cycle, picked from a ladder of sizes (e.g. 320/480/640) using the previous detections:
+# one step up when the smallest person would be too small at the model input or the stop is crowded,
+# one step down when the stop is empty, or sparse with people that would stay large enough at the lower size.
+class ResolutionLadder:
+    def __init__(self, sizes, minBoxHeight: float = 32, crowdCount: int = 10):
+        self.sizes = sorted(sizes)
+        self.minBoxHeight = minBoxHeight
+        self.crowdCount = crowdCount
+
+        # Start from the largest size, which misses nobody
+        self.index = len(self.sizes) - 1
+
+    @property
+    def imgsz(self):
+        return self.sizes[self.index]
+
+    # boxes: detections of the last burst, inputShape: size of the image given to the model (the ROI crop,
+    # if any: boxes are not rescaled by the crop, only by the letterbox)
+    def update(self, boxes, inputShape):
+        count = max((len(b) for b in boxes), default = 0)
+        if count == 0:
+            self.index = max(0, self.index - 1)
+            return self.imgsz
+
+        # Height of the smallest person at the model input (frames are letterboxed on the long side)
+        heights = np.concatenate([b[:, 3] - b[:, 1] for b in boxes if len(b)])
+        smallest = float(heights.min()) * self.imgsz / max(inputShape[:2])
+
+        if smallest < self.minBoxHeight or count >= self.crowdCount:
+            self.index = min(len(self.sizes) - 1, self.index + 1)
+        elif self.index > 0 and count < self.crowdCount / 2 and smallest * self.sizes[self.index - 1] / self.imgsz >= 2 * self.minBoxHeight:
+            self.index -= 1
+
+        return self.imgsz
+
+# Scene-change gate: compares a small grayscale copy of the burst with the last analyzed frame,
+# so detection can be skipped while the stop does not change. Only the region of interest is compared:
+# traffic outside it does not count.
+class SceneGate:
+    def __init__(self, threshold: float, maxInterval: float, pixelThreshold: int = 25, roi = None, width: int = 64):
+        self.threshold = threshold
+        self.maxInterval = maxInterval
+        self.pixelThreshold = pixelThreshold
+        self.roi = roi
+        self.width = width
+
+        # Region of interest on the signature, built once per signature size
+        self.mask = None
+
+        self.reference = None
+        self.candidate = None
+        self.lastInference = 0.0
+
+        self.checked = 0
+        self.fired = 0
+
+    def _signature(self, frame):
+        if self.roi is not None:
+            frame = self.roi.apply(frame)
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation = cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+    def _region(self, shape):
+        if self.mask is None or self.mask.shape != shape:
+            if self.roi is None:
+                self.mask = np.ones(shape, dtype = bool)
+            else:
+                self.mask = cv2.resize(self.roi.mask, (shape[1], shape[0]), interpolation = cv2.INTER_NEAREST) > 0
+        return self.mask
+
+    # Fraction (0..1) of the region whose pixels changed by more than pixelThreshold gray levels,
+    # for the most changed frame of the burst against the reference
+    def score(self, frames):
+        signatures = [self._signature(f) for f in frames]
+        self.candidate = signatures[-1]
+
+        if self.reference is None or self.reference.shape != self.candidate.shape:
+            return 1.0
+
+        region = self._region(self.candidate.shape)
+        if not region.any():
+            return 1.0
+        return max(float(np.mean(np.abs(signature - self.reference)[region] > self.pixelThreshold)) for signature in signatures)
+
+    # True when the previous detections can be reused for this burst
+    def isStatic(self, frames, now: float):
+        self.checked += 1
+
+        changed = self.score(frames) > self.threshold
+        if changed or now - self.lastInference >= self.maxInterval:
+            return False
+
+        self.fired += 1
+        return True
+
+    # The burst was analyzed: it becomes the new reference
+    def analyzed(self, now: float):
+        self.reference = self.candidate
+        self.lastInference = now
+
+# Sampling scheduler: decides how many seconds to wait before the next burst of a camera
+class Scheduler:
+    def __init__(self, minWait: float, maxWait: float, window: int = 10):
+        self.minWait = minWait
+        self.maxWait = maxWait
+
+        # Recent counts and squared deltas per second (random walk fit)
+        self.counts = collections.deque(maxlen = window)
+        self.rates = collections.deque(maxlen = window)
+        self.lastTime = None
+
+    def observe(self, count, delta, now: float):
+        if self.lastTime is not None and now > self.lastTime:
+            self.rates.append(delta * delta / (now - self.lastTime))
+        self.lastTime = now
+        self.counts.append(count)
+
+    def clamp(self, waitTime):
+        return min(max(waitTime, self.minWait), self.maxWait)
+
+    # Seconds to wait, given the last count, its delta and the predicted next count
+    def nextWait(self, count, delta, prediction, now: float):
+        raise NotImplementedError
+
+    # Expected count error when the next sample is taken, and the resulting sampling rate
+    def metrics(self, waitTime):
+        variance = sum(self.rates) / len(self.rates) if self.rates else 0.0
+        return {
+            'expected-error': round(math.sqrt(variance * waitTime), 3),
+            'samples-per-hour': round(3600 / waitTime, 3) if waitTime > 0 else 0.0
+        }
+
+# Linear policy: max-wait when nothing changed, min-wait from a delta of 10 people
+class LinearScheduler(Scheduler):
+    def __init__(self, minWait: float, maxWait: float, window: int = 10):
+        super().__init__(minWait, maxWait, window)
+
+        x0 = 0
+        x1 = 10
+
+        y0 = maxWait
+        y1 = minWait
+
+        self.m = (y0 - y1) / (x0 - x1)
+        self.q = maxWait
+
+    def nextWait(self, count, delta, prediction, now: float):
+        self.observe(count, delta, now)
+        return self.clamp(self.m * delta + self.q)
+
+# Predictive policy: samples sooner when the forecast moves away from the current count
+# or the recent counts are volatile, and backs off to max-wait on a steady stop
+class PredictiveScheduler(Scheduler):
+    def __init__(self, minWait: float, maxWait: float, window: int = 10, changeScale: float = 5):
+        super().__init__(minWait, maxWait, window)
+        self.changeScale = changeScale
+
+    def nextWait(self, count, delta, prediction, now: float):
+        self.observe(count, delta, now)
+
+        mean = sum(self.counts) / len(self.counts)
+        volatility = math.sqrt(sum((c - mean) ** 2 for c in self.counts) / len(self.counts))
+
+        change = abs(prediction - count) + volatility
+        urgency = min(1.0, change / self.changeScale)
+
+        return self.clamp(self.maxWait - (self.maxWait - self.minWait) * urgency)
+
+SCHEDULERS = {
+    'linear': LinearScheduler,
+    'predictive': PredictiveScheduler
+}
+
+def createScheduler(policy: str, minWait: float, maxWait: float, **options):
+    if policy not in SCHEDULERS:
+        raise Exception(f"Unknown scheduler: {policy}")
+    if policy == 'linear':
+        options.pop('changeScale', None)
+    return SCHEDULERS[policy](minWait, maxWait, **options)
+
+# Per-cycle stage timers, cheap enough to stay always on
+class StageTimer:
+    def __init__(self):
+        self.timings = {}
+
+    def reset(self):
+        self.timings.clear()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    # Influx fields, in milliseconds
+    def fields(self):
+        return {f'{name}-ms': round(seconds * 1000, 3) for name, seconds in self.timings.items()}
+
+# Pipeline stage: a thread taking items from a bounded queue, running the handler and handing its result
+# (if not None) to the next stage. A full queue blocks the stage before it (backpressure), or drops by policy:
+# drop-oldest replaces the oldest waiting item, drop-newest discards the new one. Items that waited longer
+# than maxAge are dropped as stale. onDrop receives every item that is dropped, stale or failed.
+class Stage:
+    POLICIES = ('block', 'drop-oldest', 'drop-newest')
+    STOP = object()
+
+    def __init__(self, name, handler, queueSize: int = 2, policy: str = 'block', maxAge: float = None, onDrop = None, log = None):
+        if policy not in self.POLICIES:
+            raise Exception(f"Unknown drop policy: {policy}")
+
+        self.name = name
+        self.handler = handler
+        self.policy = policy
+        self.maxAge = maxAge
+        self.onDrop = onDrop
+        self.log = log
+        self.next = None
+
+        # (time it was queued, item)
+        self.queue = queue.Queue(maxsize = queueSize)
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+        self.stale = 0
+        self.errors = 0
+        self.busy = 0.0
+
+        # Start of the item being processed (None when idle)
+        self.workingSince = None
+        self.thread = None
+
+    # Non-blocking, never drops: False if the queue is full
+    def offer(self, item):
+        try:
+            self.queue.put_nowait((time.monotonic(), item))
+            return True
+        except queue.Full:
+            return False
+
+    def put(self, item):
+        entry = (time.monotonic(), item)
+        if self.policy == 'block':
+            self.queue.put(entry)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(entry)
+                return
+            except queue.Full:
+                if self.policy == 'drop-newest':
+                    self._drop(item)
+                    return
+            try:
+                self._drop(self.queue.get_nowait()[1])
+            except queue.Empty:
+                pass
+
+    def start(self):
+        self.thread = threading.Thread(target = self._run, name = f'stage-{self.name}', daemon = True)
+        self.thread.start()
+
+    # Processing the same item for longer than timeout
+    def stalled(self, timeout: float):
+        since = self.workingSince
+        return since is not None and time.monotonic() - since > timeout
+
+    def fields(self, stallTimeout: float = 300):
+        with self.lock:
+            return {
+                f'stage-{self.name}-queue': self.queue.qsize(),
+                f'stage-{self.name}-processed': self.processed,
+                f'stage-{self.name}-dropped': self.dropped,
+                f'stage-{self.name}-stale': self.stale,
+                f'stage-{self.name}-errors': self.errors,
+                f'stage-{self.name}-busy-s': round(self.busy, 3),
+                f'stage-{self.name}-stalled': int(self.stalled(stallTimeout))
+            }
+
+    def _drop(self, item, counter = 'dropped'):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        if self.onDrop is not None:
+            self.onDrop(item)
+
+    def _run(self):
+        while True:
+            queued, item = self.queue.get()
+            if item is self.STOP:
+                if self.next is not None:
+                    self.next.queue.put((time.monotonic(), self.STOP))
+                break
+
+            if self.maxAge is not None and time.monotonic() - queued > self.maxAge:
+                self._drop(item, 'stale')
+                continue
+
+            self.workingSince = time.monotonic()
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                if self.log is not None:
+                    self.log.error(self.name, 'Pipeline stage failed', e)
+                self.workingSince = None
+                self._drop(item, 'errors')
+                continue
+
+            with self.lock:
+                self.busy += time.monotonic() - self.workingSince
+                self.processed += 1
+            self.workingSince = None
+
+            if result is not None and self.next is not None:
+                self.next.put(result)
+
+# Stages connected in order: each one runs in its own thread, so I/O of a stage overlaps the work of the others
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = stages
+        for stage, following in zip(stages, stages[1:]):
+            stage.next = following
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    # Non-blocking submission to the first stage
+    def offer(self, item):
+        return self.stages[0].offer(item)
+
+    # Clean shutdown: the items already queued are processed, then every stage stops in order
+    def stop(self):
+        self.stages[0].queue.put((time.monotonic(), Stage.STOP))
+        for stage in self.stages:
+            stage.thread.join()
+
+    def stalled(self, timeout: float):
+        return any(stage.stalled(timeout) for stage in self.stages)
+
+    def fields(self, stallTimeout: float = 300):
+        fields = {}
+        for stage in self.stages:
+            fields.update(stage.fields(stallTimeout))
+        return fields
+
+# Bus count predictor: a preallocated float32 ring buffer of the last counts of every source.
+# All the sources are predicted with a single invoke() and rolled forward over a multi-step horizon.
+class CountPredictor:
+    def __init__(self, modelPath, sources: int = 1, horizon: int = 1):
+        import tflite_runtime.interpreter as tflite
+        self.interpreter = tflite.Interpreter(model_path = modelPath)
+
+        inputDetails = self.interpreter.get_input_details()[0]
+        self.inputIndex = inputDetails['index']
+        self.window = int(inputDetails['shape'][1])
+
+        # One batch row per source
+        if sources != inputDetails['shape'][0]:
+            self.interpreter.resize_tensor_input(self.inputIndex, [sources, self.window, 1])
+        self.interpreter.allocate_tensors()
+        self.outputIndex = self.interpreter.get_output_details()[0]['index']
+
+        self.sources = sources
+        self.horizon = max(1, horizon)
+
+        # Ring buffers, write positions and whether a source has received its first count
+        self.history = np.zeros((sources, self.window), dtype = np.float32)
+        self.head = np.zeros(sources, dtype = np.int64)
+        self.primed = np.zeros(sources, dtype = bool)
+
+        # Ordered windows for the roll-forward (two buffers, swapped at every step) and the forecasts
+        self.work = np.zeros((sources, self.window), dtype = np.float32)
+        self.next = np.zeros((sources, self.window), dtype = np.float32)
+        self.predictions = np.zeros((sources, self.horizon), dtype = np.float32)
+
+    # Add the latest count of a source (the first one fills the whole window)
+    def push(self, source: int, count):
+        if not self.primed[source]:
+            self.history[source, :] = count
+            self.primed[source] = True
+        else:
+            self.history[source, self.head[source]] = count
+            self.head[source] = (self.head[source] + 1) % self.window
+
+    # Window of a source, oldest count first
+    def ordered(self, source: int):
+        return np.roll(self.history[source], -self.head[source])
+
+    # Forecast the next `horizon` counts of every source
+    def predictAll(self):
+        # Oldest count first
+        for source in range(self.sources):
+            head = self.head[source]
+            self.work[source, :self.window - head] = self.history[source, head:]
+            self.work[source, self.window - head:] = self.history[source, :head]
+
+        for step in range(self.horizon):
+            # Written straight into the input tensor (the view must be released before invoke)
+            self.interpreter.tensor(self.inputIndex)()[:, :, 0] = self.work
+            self.interpreter.invoke()
+
+            output = self.interpreter.tensor(self.outputIndex)()
+            self.predictions[:, step] = output.reshape(self.sources, -1)[:, 0]
+            del output
+
+            # Roll forward: the prediction becomes the newest count
+            self.next[:, :-1] = self.work[:, 1:]
+            self.next[:, -1] = self.predictions[:, step]
+            self.work, self.next = self.next, self.work
+
+        return self.predictions
+
+    # Push a count and return the forecast of that source
+    def update(self, source: int, count):
+        self.push(source, count)
+        return self.predictAll()[source]
+
+# Draw the detected boxes on a copy of the frame
+def drawDetections(frame, boxes):
+    drawnFrame = frame.copy()
+    for i in boxes:
+        drawnFrame = cv2.rectangle(drawnFrame, (int(i[0]), int(i[1])), (int(i[2]), int(i[3])), (0,255,) ,2)
+    return drawnFrame
+
+# Annotated snapshots of the last cycles, kept in memory: boxes are drawn and the JPEG is encoded
+# only when somebody asks for it
+class SnapshotRing:
+    def __init__(self, size: int = 10):
+        # Newest last: (sequence, camera, timestamp, frame, boxes)
+        self.snapshots = collections.deque(maxlen = size)
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+    def add(self, camera: int, timestamp: float, frame, boxes):
+        with self.lock:
+            self.sequence += 1
+            self.snapshots.append((self.sequence, camera, timestamp, frame, boxes))
+
+    # index 0 is the newest snapshot (of the given camera, if any)
+    def get(self, index: int = 0, camera: int = None):
+        with self.lock:
+            snapshots = [s for s in self.snapshots if camera is None or s[1] == camera]
+        if index >= len(snapshots):
+            return None
+        return snapshots[-1 - index]
+
+    def list(self):
+        with self.lock:
+            return [{'sequence': s[0], 'camera': s[1], 'timestamp': s[2], 'count': len(s[4])} for s in reversed(self.snapshots)]
+
+    def render(self, snapshot, scale: float = 1.0):
+        frame = drawDetections(snapshot[3], snapshot[4])
+        if scale != 1.0:
+            frame = cv2.resize(frame, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        return frame
+
+    def encode(self, snapshot, quality: int = 80, scale: float = 1.0):
+        _, jpeg = cv2.imencode('.jpg', self.render(snapshot, scale), [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return jpeg.tobytes()
+
+# Local HTTP endpoint of the snapshot ring:
+#   /                 list of the snapshots in memory (JSON)
+#   /snapshot         newest annotated snapshot as JPEG (?camera=0&index=0&quality=80&scale=0.5)
+#   /stream           low-FPS MJPEG preview (?camera=0&fps=1&quality=80&scale=0.5)
+class SnapshotHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        ring = self.server.ring
+
+        # Every parameter is parsed and range checked up front: a bad value is a 400
+        try:
+            camera = int(query['camera']) if 'camera' in query else None
+            index = int(query.get('index', 0))
+            quality = int(query.get('quality', self.server.quality))
+            scale = float(query.get('scale', self.server.scale))
+            fps = float(query.get('fps', self.server.fps))
+            if camera is not None and camera < 0 or index < 0 or not 0 < quality <= 100:
+                raise ValueError
+            if not (math.isfinite(scale) and scale > 0 and math.isfinite(fps) and fps > 0):
+                raise ValueError
+        except ValueError:
+            self.send_error(400)
+            return
+
+        if url.path == '/':
+            self._send(200, 'application/json', json.dumps(ring.list()).encode())
+        elif url.path == '/snapshot':
+            snapshot = ring.get(index, camera)
+            if snapshot is None:
+                self.send_error(404)
+            else:
+                self._send(200, 'image/jpeg', ring.encode(snapshot, quality, scale))
+        elif url.path == '/stream':
+            self._stream(camera, fps, quality, scale)
+        else:
+            self.send_error(404)
+
+    def _send(self, status, contentType, body):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Runs on the thread of this client until it disconnects
+    def _stream(self, camera, fps, quality, scale):
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.end_headers()
+
+        interval = 1 / max(fps, 0.01)
+        try:
+            while True:
+                snapshot = self.server.ring.get(0, camera)
+                if snapshot is not None:
+                    jpeg = self.server.ring.encode(snapshot, quality, scale)
+                    self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(jpeg)).encode() + b'\r\n\r\n' + jpeg + b'\r\n')
+                time.sleep(interval)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class SnapshotServer:
+    def __init__(self, ring, host: str, port: int, quality: int = 80, scale: float = 1.0, fps: float = 1):
+        self.server = http.server.ThreadingHTTPServer((host, port), SnapshotHandler)
+        self.server.daemon_threads = True
+        self.server.ring = ring
+        self.server.quality = quality
+        self.server.scale = scale
+        self.server.fps = fps
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.server.serve_forever, name = 'snapshot-server', daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Local preview window (--display): shows the newest snapshots at low FPS on its own thread,
+# so the main loop never waits on the GUI. onQuit is called when 'q' is pressed.
+class PreviewWindow:
+    def __init__(self, ring, fps: float = 1, scale: float = 1.0, onQuit = None):
+        self.ring = ring
+        self.interval = 1 / max(fps, 0.01)
+        self.scale = scale
+        self.onQuit = onQuit
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self._run, name = 'preview-window', daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def _run(self):
+        shown = {}
+        while not self.stopEvent.is_set():
+            # Newest snapshot of every camera, redrawn only when it changes
+            for entry in self.ring.list():
+                if shown.get(entry['camera']) != entry['sequence']:
+                    snapshot = self.ring.get(0, entry['camera'])
+                    if snapshot is not None:
+                        cv2.imshow(f'frame {snapshot[1]}', self.ring.render(snapshot, self.scale))
+                        shown[snapshot[1]] = snapshot[0]
+
+            # Exit on 'q' pressed (inside streaming window)
+            if cv2.waitKey(int(self.interval * 1000)) & 0xFF == ord('q'):
+                if self.onQuit is not None:
+                    self.onQuit()
+                break
+
+        cv2.destroyAllWindows()
+
+# Capture backends: plain OpenCV, or a decoding pipeline that can use the V4L2 / hardware H.264
+# decoder, scale in the decoder and pull only keyframes. Returns the arguments of cv2.VideoCapture
+# and the FFmpeg capture options to set while it is opened (None for the other backends).
+# decoder is a GStreamer element, ffmpegDecoder an FFmpeg codec name.
+def captureSource(source, backend: str = 'opencv', width: int = 0, height: int = 0, decoder: str = 'v4l2h264dec', keyframesOnly: bool = False,
+                  ffmpegDecoder: str = 'h264_v4l2m2m'):
+    if backend == 'opencv':
+        return source, cv2.CAP_ANY, None
+
+    if backend == 'gstreamer':
+        if str(source).startswith('rtsp://'):
+            pipeline = f'rtspsrc location={source} latency=0 protocols=tcp ! rtph264depay ! h264parse'
+        else:
+            pipeline = f'filesrc location={source} ! qtdemux ! h264parse'
+
+        # Delta frames are dropped before they reach the decoder
+        if keyframesOnly:
+            pipeline += ' ! identity drop-buffer-flags=delta-unit'
+
+        pipeline += f' ! {decoder}'
+
+        # Hardware scaler next to the V4L2 decoder, software one otherwise
+        pipeline += ' ! v4l2convert' if decoder.startswith('v4l2') else ' ! videoscale'
+        if width > 0 and height > 0:
+            pipeline += f' ! video/x-raw,width={width},height={height}'
+
+        pipeline += ' ! videoconvert ! video/x-raw,format=BGR ! appsink drop=true max-buffers=2 sync=false'
+        return pipeline, cv2.CAP_GSTREAMER, None
+
+    if backend == 'ffmpeg':
+        options = 'rtsp_transport;tcp'
+        if ffmpegDecoder:
+            options += f'|video_codec;{ffmpegDecoder}'
+        return source, cv2.CAP_FFMPEG, options
+
+    raise Exception(f"Unknown capture backend: {backend}")
+
+# OpenCV reads the FFmpeg capture options from the environment when a capture is opened: they are set
+# only for that open (one at a time across the cameras) and the previous value is restored
+_ffmpegOptionsLock = threading.Lock()
+
+@contextlib.contextmanager
+def _ffmpegOptions(options):
+    if options is None:
+        yield
+        return
+
+    with _ffmpegOptionsLock:
+        previous = os.environ.get('OPENCV_FFMPEG_CAPTURE_OPTIONS')
+        os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = options
+        try:
+            yield
+        finally:
+            if previous is None:
+                del os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS']
+            else:
+                os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = previous
+
+# Frame grabber: keeps one connection to the camera open on its own thread and
+# holds the newest decoded frames in a bounded ring buffer
+class FrameGrabber:
+    def __init__(self, source, bufferSize: int = 4, frameToSkip: int = 1, minBackoff: float = 1, maxBackoff: float = 60,
+                 backend: str = 'opencv', width: int = 0, height: int = 0, decoder: str = 'v4l2h264dec', keyframesOnly: bool = False, log = None,
+                 ffmpegDecoder: str = 'h264_v4l2m2m'):
+        self.source = source
+        self.log = log
+        self.backend = backend
+        self.width = width
+        self.height = height
+        self.decoder = decoder
+        self.ffmpegDecoder = ffmpegDecoder
+        self.keyframesOnly = keyframesOnly
+        self.frameToSkip = max(1, frameToSkip)
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+
+        # Ring buffer of (timestamp, frame)
+        self.frames = collections.deque(maxlen = bufferSize)
+        self.condition = threading.Condition()
+
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+        self.connected = False
+        self.reconnects = 0
+        self.fallback = False
+
+    def start(self):
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target = self._run, name = 'frame-grabber', daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Take the newest frames from the ring buffer, waiting only if not enough fresh frames are available
+    def getBurst(self, count: int, timeout: float, maxAge: float):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                fresh = [f for f in self.frames if now - f[0] <= maxAge]
+                if len(fresh) >= count:
+                    burst = fresh[-count:]
+                    return [f[1] for f in burst], [f[0] for f in burst]
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception("Unable to read frame")
+                self.condition.wait(remaining)
+
+    # Configured backend, plain OpenCV as fallback
+    def _open(self):
+        source, api, options = captureSource(self.source, self.backend, self.width, self.height, self.decoder, self.keyframesOnly, self.ffmpegDecoder)
+        with _ffmpegOptions(options):
+            camera = cv2.VideoCapture(source, api)
+
+        self.fallback = False
+        if not camera.isOpened() and self.backend != 'opencv':
+            camera.release()
+            camera = cv2.VideoCapture(self.source)
+            self.fallback = True
+            if self.log is not None:
+                self.log.error('capture', f'Unable to open the {self.backend} pipeline, falling back to plain OpenCV', source = self.source)
+
+        return camera
+
+    # Influx fields, published with the health of the camera: connection state, reconnections since startup
+    # and whether the configured backend fell back to plain OpenCV
+    def fields(self, name: str):
+        return {f'{name}-connected': int(self.connected), f'{name}-reconnects': self.reconnects, f'{name}-fallback': int(self.fallback)}
+
+    def _run(self):
+        backoff = self.minBackoff
+
+        while not self.stopEvent.is_set():
+            camera = self._open()
+
+            if camera.isOpened():
+                self.connected = True
+                counter = 0
+
+                # Only keyframes reach the decoder (one every GOP): every one of them is kept
+                stride = 1 if self.keyframesOnly and self.backend == 'gstreamer' and not self.fallback else self.frameToSkip
+
+                while not self.stopEvent.is_set():
+                    # With the FFmpeg backend grab() decodes every frame, retrieve() only converts the colours of
+                    # the kept ones: the always-open stream costs a continuous decode of all its frames, 24/7
+                    # (the hardware decoder or gstreamer keyframes-only reduce it, benchmark.py measures it)
+                    if not camera.grab():
+                        break
+
+                    if counter % stride == 0:
+                        result, frame = camera.retrieve()
+                        if not result:
+                            break
+
+                        # Pipeline not scaling (plain OpenCV fallback or ffmpeg): same frame size anyway
+                        if self.width > 0 and self.height > 0 and (frame.shape[1] != self.width or frame.shape[0] != self.height):
+                            frame = cv2.resize(frame, (self.width, self.height), interpolation = cv2.INTER_AREA)
+
+                        with self.condition:
+                            self.frames.append((time.time(), frame))
+                            self.condition.notify_all()
+
+                        # Stream is healthy again
+                        backoff = self.minBackoff
+
+                    counter += 1
+
+            # Stream dropped (or never opened): reconnect with backoff
+            camera.release()
+            if self.log is not None and not self.stopEvent.is_set():
+                self.log.retry('capture', 'Stream dropped' if self.connected else 'Unable to open stream', source = self.source, backoff = backoff)
+            self.connected = False
+
+            if self.stopEvent.wait(backoff):
+                break
+
+            backoff = min(backoff * 2, self.maxBackoff)
+            self.reconnects += 1
+
+# Invalid configuration
+class ConfigError(Exception):
+    pass
+
+REQUIRED = object()
+
+# 'inference-conf' -> 'inferenceConf'
+def _attribute(key):
+    head, *rest = key.split('-')
+    return head + ''.join(word.capitalize() for word in rest)
+
+def _checkValue(value, kind, path):
+    if isinstance(kind, tuple):
+        if value not in kind:
+            raise ConfigError(f"{path}: expected one of {', '.join(map(str, kind))}, got {value!r}")
+        return value
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    if (kind is int and isinstance(value, bool)) or not isinstance(value, kind):
+        raise ConfigError(f"{path}: expected {kind.__name__}, got {value!r}")
+    return value
+
+def _checkRoi(roi):
+    for shape in roi:
+        if not isinstance(shape, dict):
+            return False
+        if 'rect' in shape and not (isinstance(shape['rect'], list) and len(shape['rect']) == 4):
+            return False
+        if 'polygon' in shape and not (isinstance(shape['polygon'], list) and len(shape['polygon']) >= 3):
+            return False
+        if 'rect' not in shape and 'polygon' not in shape:
+            return False
+    return True
+
+_positive = (lambda v: v > 0, 'must be > 0')
+_nonNegative = (lambda v: v >= 0, 'must be >= 0')
+
+# Settings section: parsed once from a dict, type checked, with defaults. Every key of FIELDS
+# (key, type or tuple of choices, default, optional (check, message)) becomes a slot in camelCase.
+class Section:
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, data: dict, path: str):
+        if not isinstance(data, dict):
+            raise ConfigError(f"{path}: expected an object")
+
+        known = {field[0] for field in self.FIELDS}
+        unknown = [key for key in data if key not in known]
+        if unknown:
+            raise ConfigError(f"{path}: unknown keys {', '.join(unknown)}")
+
+        for key, kind, default, *check in self.FIELDS:
+            value = data.get(key, default)
+            if value is REQUIRED:
+                raise ConfigError(f"{path}.{key}: missing")
+
+            value = _checkValue(value, kind, f"{path}.{key}")
+            if check and not check[0][0](value):
+                raise ConfigError(f"{path}.{key}: {check[0][1]}, got {value!r}")
+
+            setattr(self, _attribute(key), value)
+
+    # Attributes whose value differs from another section of the same kind
+    def changed(self, other):
+        return {slot for slot in self.__slots__ if getattr(self, slot) != getattr(other, slot)}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and not self.changed(other)
+
+class InfluxSettings(Section):
+    FIELDS = (
+        ('url', str, ''),
+        ('org', str, ''),
+        ('token', str, ''),
+        ('bucket', str, ''),
+        ('host', str, ''),
+        ('location', str, ''),
+        ('room', str, ''),
+        ('urlAdriabus', str, ''),
+        ('batch-size', int, 100, _positive),
+        ('flush-interval', float, 5.0, _positive),
+        ('queue-size', int, 10000, _positive),
+        ('max-retries', int, 3, _nonNegative),
+        ('retry-interval', float, 2.0, _positive),
+        ('max-backoff', float, 300.0, _positive),
+        ('adriabus-connect-timeout', float, 5.0, _positive),
+        ('adriabus-read-timeout', float, 10.0, _positive)
+    )
+    __slots__ = tuple(_attribute(field[0]) for field in FIELDS)
+
+class ApplicationSettings(Section):
+    FIELDS = (
+        ('log-file-path', str, 'errors.log'),
+        ('log-max-size', int, 1000000, _positive),
+        ('log-backups', int, 3, _nonNegative),
+        ('log-ring-size', int, 1000, _positive),
+        ('log-flush-interval', float, 60.0, _positive),
+        ('source', str, ''),
+        ('sources', list, []),
+        ('consumer-max-downtime', int, 900),
+        ('outbox-path', str, 'outbox.db'),
+        ('outbox-max-size', int, 50000000, _positive),
+        ('outbox-max-age', float, 604800.0, _positive),
+        ('outbox-drain-interval', float, 30.0, _positive),
+        ('outbox-drain-batch', int, 500, _positive),
+        ('publisher-workers', int, 2, _positive),
+        ('send-timings', bool, True),
+        ('model-path', str, REQUIRED),
+        ('inference-backend', tuple(BACKENDS), 'pytorch'),
+        ('inference-conf', float, 0.5, (lambda v: 0 < v < 1, 'must be between 0 and 1')),
+        ('inference-imgsz', int, 640, (lambda v: v > 0 and v % 32 == 0, 'must be a positive multiple of 32')),
+        ('inference-imgsz-ladder', list, [], (lambda v: all(isinstance(s, int) and s > 0 and s % 32 == 0 for s in v), 'must be a list of positive multiples of 32')),
+        ('imgsz-min-box-height', float, 32.0, _positive),
+        ('imgsz-crowd-count', int, 10, _positive),
+        ('tracking-enabled', bool, False),
+        ('tracking-key-interval', int, 4, _positive),
+        ('tracking-iou', float, 0.3, (lambda v: 0 < v < 1, 'must be between 0 and 1')),
+        ('tracking-max-misses', int, 1, _nonNegative),
+        ('scene-gate-enabled', bool, False),
+        ('scene-gate-threshold', float, 0.01, (lambda v: 0 <= v < 1, 'must be between 0 and 1')),
+        ('scene-gate-pixel-threshold', int, 25, (lambda v: 0 < v < 255, 'must be between 1 and 254')),
+        ('scene-gate-max-interval', float, 900.0, _nonNegative),
+        ('roi', list, [], (_checkRoi, 'expected a list of {"rect": [x1, y1, x2, y2]} or {"polygon": [[x, y], ...]}')),
+        ('predictor-path', str, '/home/pi/Desktop/BusSensor/bus_count_predictor.tflite'),
+        ('prediction-horizon', int, 1, _positive),
+        ('inference-batch-size', int, 4, _positive),
+        ('inference-workers', int, 0, _nonNegative),
+        ('warmup-image', str, ''),
+        ('min-wait', float, 60.0, _positive),
+        ('max-wait', float, 600.0, _nonNegative),
+        ('scheduler', tuple(SCHEDULERS), 'linear'),
+        ('scheduler-window', int, 10, _positive),
+        ('scheduler-change-scale', float, 5.0, _positive),
+        ('frame-to-skip', int, 15, _positive),
+        ('burst-size', int, 4, _positive),
+        ('burst-timeout', float, 30.0, _positive),
+        ('max-frame-age', float, 10.0, _positive),
+        ('reconnect-min-backoff', float, 1.0, _positive),
+        ('reconnect-max-backoff', float, 60.0, _positive),
+        ('recovery-min-backoff', float, 2.0, _positive),
+        ('recovery-max-backoff', float, 120.0, _positive),
+        ('recovery-reboot-budget', float, 1800.0, _positive),
+        ('capture-backend', ('opencv', 'gstreamer', 'ffmpeg'), 'opencv'),
+        ('capture-width', int, 0, _nonNegative),
+        ('capture-height', int, 0, _nonNegative),
+        ('capture-decoder', str, 'v4l2h264dec'),
+        ('capture-ffmpeg-decoder', str, 'h264_v4l2m2m'),
+        ('capture-keyframes-only', bool, False),
+        ('capture-keyframe-interval', float, 2.0, _positive),
+        ('save-last-frame', bool, False),
+        ('last-frame-path', str, 'last-frame.jpg'),
+        ('snapshot-ring-size', int, 10, _positive),
+        ('snapshot-host', str, '127.0.0.1'),
+        ('snapshot-port', int, 8080, _nonNegative),
+        ('snapshot-quality', int, 80, (lambda v: 0 < v <= 100, 'must be between 1 and 100')),
+        ('snapshot-scale', float, 1.0, _positive),
+        ('preview-fps', float, 1.0, _positive),
+        ('run-mode', ('serial', 'pipeline'), 'serial'),
+        ('pipeline-queue-size', int, 2, _positive),
+        ('pipeline-drop-policy', Stage.POLICIES, 'drop-oldest'),
+        ('pipeline-max-job-age', float, 30.0, _positive),
+        ('pipeline-stall-timeout', float, 300.0, _positive)
+    )
+    __slots__ = tuple(_attribute(field[0]) for field in FIELDS)
+
+# One camera: an entry of application.sources, falling back to the top-level source, Influx tags, ROI and waits
+class CameraSettings(Section):
+    FIELDS = (
+        ('source', str, REQUIRED),
+        ('host', str, ''),
+        ('location', str, ''),
+        ('room', str, ''),
+        ('roi', list, [], (_checkRoi, 'expected a list of {"rect": [x1, y1, x2, y2]} or {"polygon": [[x, y], ...]}')),
+        ('min-wait', float, 60.0, _positive),
+        ('max-wait', float, 600.0, _nonNegative),
+        ('last-frame-path', str, 'last-frame.jpg')
+    )
+    __slots__ = tuple(_attribute(field[0]) for field in FIELDS)
+
+# The whole configuration (a single camera when no sources are listed)
+class Settings:
+    __slots__ = ('influx', 'application', 'cameras')
+
+    def __init__(self, data: dict):
+        if not isinstance(data, dict):
+            raise ConfigError("configuration: expected an object")
+
+        self.influx = InfluxSettings(data.get('influx', {}), 'influx')
+        self.application = ApplicationSettings(data.get('application', {}), 'application')
+
+        influx = self.influx
+        application = self.application
+        defaults = {
+            'source': application.source,
+            'host': influx.host,
+            'location': influx.location,
+            'room': influx.room,
+            'roi': application.roi,
+            'min-wait': application.minWait,
+            'max-wait': application.maxWait,
+            'last-frame-path': application.lastFramePath
+        }
+
+        sources = application.sources or [{}]
+        self.cameras = []
+        for i, source in enumerate(sources):
+            if not isinstance(source, dict):
+                raise ConfigError(f"application.sources[{i}]: expected an object")
+
+            camera = dict(defaults)
+            camera.update(source)
+
+            # One snapshot file per camera
+            if 'last-frame-path' not in source and len(sources) > 1:
+                base, ext = os.path.splitext(defaults['last-frame-path'])
+                camera['last-frame-path'] = f'{base}-{i}{ext}'
+
+            self.cameras.append(CameraSettings(camera, f"application.sources[{i}]"))
+
+        if application.inferenceImgszLadder and application.inferenceBackend in STATIC_BACKENDS:
+            raise ConfigError(f"application.inference-imgsz-ladder: not supported by the {application.inferenceBackend} backend (fixed input size)")
+
+        # Keyframes only: a burst spans burst-size keyframes, which must all be fresh enough
+        if application.captureKeyframesOnly and application.captureBackend == 'gstreamer':
+            span = application.burstSize * application.captureKeyframeInterval
+            if span > application.maxFrameAge:
+                raise ConfigError(f"application.capture-keyframes-only: a burst spans {span:g} s of keyframes (burst-size x capture-keyframe-interval), more than max-frame-age ({application.maxFrameAge:g} s)")
+
+        for i, camera in enumerate(self.cameras):
+            if camera.minWait > camera.maxWait:
+                raise ConfigError(f"application.sources[{i}]: min-wait ({camera.minWait}) is greater than max-wait ({camera.maxWait})")
+
+# Configuration file, parsed and validated
+def loadSettings(filename):
+    try:
+        return Settings(loadConfig(filename))
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"{filename}: {e}")
+
+# Reload trigger: SIGHUP or a change of the file modification time
+class ConfigWatcher:
+    def __init__(self, filename):
+        self.filename = filename
+        self.mtime = self._mtime()
+        self.signaled = threading.Event()
+
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.signaled.set())
+
+    def _mtime(self):
+        try:
+            return os.stat(self.filename).st_mtime
+        except OSError:
+            return None
+
+    def changed(self):
+        mtime = self._mtime()
+        if self.signaled.is_set() or mtime != self.mtime:
+            self.signaled.clear()
+            self.mtime = mtime
+            return True
+        return False
\ No newline at end of file